@@ -0,0 +1 @@
+../../common/textcache.py
\ No newline at end of file
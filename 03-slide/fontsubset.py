@@ -0,0 +1 @@
+../fontsubset.py
\ No newline at end of file
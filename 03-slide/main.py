@@ -17,14 +17,18 @@
 import asyncio
 import contextlib
 import dataclasses
+import functools
 import itertools
 import re
 import sys
-import time
 from pathlib import Path
 
 import pyxel
 
+import fontsubset
+import perf
+import tracer
+
 
 TITLE = "Pyxel app 03-slide"
 MD_FILENAME = "assets/03-slide.md"
@@ -40,13 +44,34 @@ WIDTH = HEIGHT * 16 // 9
 KEY_REPEAT = 1  # for 30fps
 KEY_HOLD = 15  # for 30fps
 
+
+@functools.cache
+def load_font(filename: str, fallback: str | None = None) -> pyxel.Font:
+    """fontsubset.py で生成したサブセット(スライドで使う文字だけ)を読み込む
+
+    サブセットがなければ元のフォントを、どちらもなければ fallback を読み込む。
+    """
+    path = Path(filename)
+    for candidate in (fontsubset.subset_path(path), path):
+        if candidate.exists():
+            return pyxel.Font(str(candidate))
+    if fallback is not None:
+        return load_font(fallback)
+    raise FileNotFoundError(filename)
+
+
+# スライドやコードが元のフォントより後に変わっていれば、サブセットを作り直す
+# (make.py を通さずに実行しても、新しく使った文字が空白にならない)
+fontsubset.process_directory(Path("."))
+
 # The Font class only supports BDF format fonts
-font_title = pyxel.Font("assets/b24_b.bdf")
-font_pagetitle = pyxel.Font("assets/b16_b.bdf")
-font_default = pyxel.Font("assets/b12.bdf")
-font_bold = pyxel.Font("assets/b12_b.bdf")
-font_italic = pyxel.Font("assets/b12_i.bdf")
-font_literal = pyxel.Font("assets/b12.bdf")
+# b24_b.bdf (efont) はリポジトリに含めていないので、なければタイトルも b16_b で描く
+font_title = load_font("assets/b24_b.bdf", fallback="assets/b16_b.bdf")
+font_pagetitle = load_font("assets/b16_b.bdf")
+font_default = load_font("assets/b12.bdf")
+font_bold = load_font("assets/b12_b.bdf")
+font_italic = load_font("assets/b12_i.bdf")
+font_literal = load_font("assets/b12.bdf")
 FONTS = {
     "title": font_title,
     "pagetitle": font_pagetitle,
@@ -77,34 +102,6 @@ class Slide:
     level: str
 
 
-class FPS:
-    def __init__(self):
-        self.value = 0
-        self.frame_times = [time.time()] * 30
-
-    def calc(self):
-        self.frame_times.append(time.time())
-        self.frame_times.pop(0)
-        # 10フレームごとにFPSを計算
-        if pyxel.frame_count % 10:
-            return
-        self.value = int(
-            len(self.frame_times) / (self.frame_times[-1] - self.frame_times[0])
-        )
-
-    def __rmul__(self, other):
-        return self.value * other
-
-    def __rtruediv__(self, other):
-        return other / self.value
-
-    def __floordiv__(self, other):
-        return self.value // other
-
-    def __str__(self):
-        return str(self.value)
-
-    
 class NavBtn:
     DOWN = 0
     LEFT = 1
@@ -187,7 +184,7 @@ class NavBtn:
 
 class App:
     def __init__(self):
-        self.fps = FPS()
+        self.fps = perf.FPS("03-slide", overlay=perf.OVERLAY)
         pyxel.init(
             WIDTH + WINDOW_PADDING * 2,
             HEIGHT + WINDOW_PADDING,
@@ -207,7 +204,7 @@ class App:
         self.reset()
 
         # run forever
-        pyxel.run(self.update, self.draw)
+        pyxel.run(*self.fps.wrap(self.update, self.draw))
 
     def reset(self):
         self.renderd_page_bank = [
@@ -349,8 +346,8 @@ class App:
 
         return False
 
+    @tracer.scoped("slide.update")
     def update(self):
-        self.fps.calc()
         self.child_is_updated = self.update_child()
         if self.child_is_updated:
             return
@@ -376,6 +373,7 @@ class App:
             else:
                 self.go_forward()
 
+    @tracer.scoped("slide.draw")
     def draw(self):
         pyxel.cls(7)
         self.blt_slide()
@@ -386,6 +384,7 @@ class App:
         # FPSを表示
         pyxel.text(5, pyxel.height - 10, f"FPS: {self.fps}", 13)
 
+    @tracer.scoped("slide.render_page")
     def render_page(self, page: int) -> pyxel.Image:
         """render page to old image bank"""
         for p, img in self.renderd_page_bank:
@@ -536,6 +535,7 @@ class Visitor:
         self.section_level = 0
         self.align = "left"
         self.list_stack = []  # 箇条書きのマーク用
+        self.handlers = self.bind_handlers()  # token.type: (visit, depart)
 
     @property
     def color(self):
@@ -599,26 +599,47 @@ class Visitor:
         dedent = self.indent_stack.pop() - self.indent_stack[-1]
         self.x -= dedent
 
+    @classmethod
+    def dispatch_table(cls) -> dict[str, tuple]:
+        """トークン種別 -> (visit関数, depart関数) の表をクラスごとに1回だけ作る"""
+        table = cls.__dict__.get("_dispatch_table")
+        if table is None:
+            table = {}
+            for name in dir(cls):
+                for i, prefix in enumerate(("visit_", "depart_")):
+                    if name.startswith(prefix):
+                        entry = table.setdefault(name[len(prefix) :], [None, None])
+                        entry[i] = getattr(cls, name)
+            table = {k: tuple(v) for k, v in table.items()}
+            cls._dispatch_table = table
+            cls._unknown_types = set()
+        return table
+
+    def bind_handlers(self) -> dict[str, tuple]:
+        """ディスパッチ表の関数をこのインスタンスに束縛する"""
+        return {
+            token_type: tuple(f and f.__get__(self) for f in funcs)
+            for token_type, funcs in self.dispatch_table().items()
+        }
+
+    def unknown_handler(self, token_type: str) -> tuple[None, None]:
+        # 未対応のトークン種別は、クラスごとに1回だけ表示する
+        if token_type not in self._unknown_types:
+            self._unknown_types.add(token_type)
+            print("visit", token_type)
+        handler = self.handlers[token_type] = (None, None)
+        return handler
+
     def walk(self, tokens):
+        handlers = self.handlers
         for token in tokens:
-            self.visit(token)
+            visit, depart = handlers.get(token.type) or self.unknown_handler(token.type)
+            if visit:
+                visit(token)
             if token.children:
                 self.walk(token.children)
-            self.depart(token)
-
-    def visit(self, token):
-        method_name = f"visit_{token.type}"
-        if hasattr(self, method_name):
-            method = getattr(self, method_name)
-            method(token)
-        else:
-            print("visit", token.type)
-
-    def depart(self, token):
-        method_name = f"depart_{token.type}"
-        if hasattr(self, method_name):
-            method = getattr(self, method_name)
-            method(token)
+            if depart:
+                depart(token)
 
     def visit_heading_open(self, token):
         if token.tag == "h1":
@@ -883,8 +904,12 @@ async def main():
 
 
 if __name__ == "__main__":
-    loop = asyncio.get_event_loop()
-    if loop.is_running():
+    try:
+        loop = asyncio.get_event_loop()
+    except RuntimeError:
+        # 同じプロセスで asyncio.run の後にもう1度実行した (bench.py の繰り返し)
+        loop = None
+    if loop is not None and loop.is_running():
         # Pyodide上では用意されているイベントループを使って実行
         asyncio.ensure_future(main())
     else:
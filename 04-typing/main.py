@@ -18,11 +18,14 @@ import time
 
 import pyxel
 
+import textcache
+
 TITLE = "Pyxel app 04-typing"
 WIDTH = 320
 HEIGHT = 180
 
-font = pyxel.Font("assets/umplus_j12r.bdf")
+# fontsubset.py で生成した、使用する文字だけのサブセット
+font = pyxel.Font("assets/umplus_j12r.subset.bdf")
 
 
 def load_words():
@@ -31,17 +34,8 @@ def load_words():
 
 
 def draw_text_with_border(x, y, s, col, bcol, font):
-    for dx in range(-1, 2):
-        for dy in range(-1, 2):
-            if dx != 0 or dy != 0:
-                pyxel.text(
-                    x + dx,
-                    y + dy,
-                    s,
-                    bcol,
-                    font,
-                )
-    pyxel.text(x, y, s, col, font)
+    # 縁取り文字は画像にキャッシュして、画面へは blt 1回で描画する
+    textcache.draw_text_with_border(pyxel, x, y, s, col, bcol, font)
 
 
 class App:
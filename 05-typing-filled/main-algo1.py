@@ -24,7 +24,8 @@ HEIGHT = 180
 CHAR_WIDTH = 6
 MAX_LINES = 8
 
-font = pyxel.Font("assets/umplus_j12r.bdf")
+# fontsubset.py で生成した、使用する文字だけのサブセット
+font = pyxel.Font("assets/umplus_j12r.subset.bdf")
 
 
 def load_words():
@@ -19,6 +19,9 @@ import dataclasses
 
 import pyxel
 
+import tracer
+from textcache import draw_text_with_border
+
 TITLE = "Pyxel app 05-typing-filled"
 WIDTH = 320
 HEIGHT = 180
@@ -26,7 +29,8 @@ CHAR_WIDTH = 6
 LINE_HEIGHT = 14
 MAX_LINES = 8
 
-font = pyxel.Font("assets/umplus_j12r.bdf")
+# fontsubset.py で生成した、使用する文字だけのサブセット
+font = pyxel.Font("assets/umplus_j12r.subset.bdf")
 
 
 def load_words():
@@ -164,20 +168,6 @@ class WordSet:
                 word.draw(img, x, y)
 
 
-def draw_text_with_border(img, x, y, s, col, bcol, font):
-    for dx in range(-1, 2):
-        for dy in range(-1, 2):
-            if dx != 0 or dy != 0:
-                img.text(
-                    x + dx,
-                    y + dy,
-                    s,
-                    bcol,
-                    font,
-                )
-    img.text(x, y, s, col, font)
-
-
 class App:
     def __init__(self, width, height):
         self.width = width
@@ -203,6 +193,7 @@ class App:
     def finish(self):
         self.started = False
 
+    @tracer.scoped("typing.update")
     def update(self):
         if not self.started:
             # スタートしていない
@@ -250,6 +241,7 @@ class App:
             return self.error / self.time * 60
         return 0
 
+    @tracer.scoped("typing.render")
     def render(self):
         g = self.img
         g.cls(1)
@@ -294,9 +286,11 @@ class ParentApp:
         self.child = App(width=WIDTH, height=HEIGHT)
         pyxel.run(self.update, self.draw)
 
+    @tracer.scoped("parent.update")
     def update(self):
         self.child.update()
 
+    @tracer.scoped("parent.draw")
     def draw(self):
         g = self.child.render()
         pyxel.blt(
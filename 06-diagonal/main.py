@@ -12,12 +12,16 @@
 # ]
 # ///
 
-import time
+import array
 import pyxel
 
+import perf
+import textcache
+
 TITLE = "Pyxel app 06-diagonal"
 
-font = pyxel.Font("assets/umplus_j12r.bdf")
+# fontsubset.py で生成した、使用する文字だけのサブセット
+font = pyxel.Font("assets/umplus_j12r.subset.bdf")
 
 
 class App:
@@ -30,64 +34,92 @@ class App:
         self.lh = 15  # line height
         self.wpl = self.width // ww + 2  # word per line
         self.lc = self.height // self.lh + 1  # line count
-        self.positions = []
+        # 単語の初期位置を配列で持ち、全単語共通のスクロール量を足して周期で折り返す
+        # x: -ww 〜 wpl*ww-ww, y: -lh 〜 height の範囲を周回する
+        self.period_x = self.wpl * ww
+        self.period_y = self.height + self.lh + 1
+        self.base_x = array.array("i")
+        self.base_y = array.array("i")
         for i in range(self.wpl * self.lc):
             col = i % self.wpl
             row = i // self.wpl
-            x = col * ww - row * ww // 7
-            y = row * self.lh
-            self.positions.append((x, y))
-        self.frame_times = [time.time()] * 30
-
-    def calc_fps(self):
-        self.frame_times.append(time.time())
-        self.frame_times.pop(0)
-        # 10フレームごとにFPSを計算
-        if pyxel.frame_count % 10:
-            return
-        self.fps = int(
-            len(self.frame_times) / (self.frame_times[-1] - self.frame_times[0])
-        )
+            self.base_x.append(col * ww - row * ww // 7 + ww)
+            self.base_y.append(row * self.lh + self.lh)
+        self.scroll_x = 0
+        self.scroll_y = 0
+        self.use_tile = True  # タイル画像の合成で描画するか
+        self.tile = self.render_tile()
+        self.fps = perf.FPS("06-diagonal", overlay=perf.OVERLAY)
 
     def update(self):
-        self.calc_fps()
-        for i, (x, y) in enumerate(self.positions):
-            x, y = (x - 1, y + 1)
-            if x < -font.text_width(self.word):
-                x += self.wpl * self.ww
-            if y > self.height:
-                y = -self.lh
-            self.positions[i] = (x, y)
+        if pyxel.btnp(pyxel.KEY_T):
+            self.use_tile = not self.use_tile
+        # 全単語が同じだけ動くので、スクロール量だけを進める
+        self.scroll_x = (self.scroll_x - 1) % self.period_x
+        self.scroll_y = (self.scroll_y + 1) % self.period_y
+
+    def positions(self):
+        """各単語の現在位置 (x, y) を順に返す"""
+        sx, sy = self.scroll_x, self.scroll_y
+        px, py = self.period_x, self.period_y
+        ww, lh = self.ww, self.lh
+        for x, y in zip(self.base_x, self.base_y):
+            yield (x + sx) % px - ww, (y + sy) % py - lh
 
     def cls(self, col):
         pyxel.cls(col)
 
+    def render_tile(self) -> pyxel.Image:
+        """模様1周期分 (period_x x period_y) をタイル画像に描画する
+
+        タイル上の (u, v) は、スクロール量 0 のときの画面上の (u - ww, v - lh)。
+        周期の境界をまたぐ単語は、反対側にも描画して上下左右につながるようにする。
+        """
+        px, py = self.period_x, self.period_y
+        tile = pyxel.Image(px, py)
+        tile.cls(1)
+        for i, (x, y) in enumerate(zip(self.base_x, self.base_y)):
+            for u in (x % px - px, x % px, x % px + px):
+                for v in (y % py - py, y % py, y % py + py):
+                    if -self.ww <= u <= px and -self.lh <= v <= py:
+                        textcache.draw_text_with_border(
+                            tile, u, v, self.word, i, (8 + i) % 16, font
+                        )
+        return tile
+
+    def blt_tile(self):
+        """スクロール量に合わせて、タイル画像を最大4回のbltで画面に敷き詰める"""
+        px, py = self.period_x, self.period_y
+        u = (self.ww - self.scroll_x) % px
+        v = (self.lh - self.scroll_y) % py
+        w = min(self.width, px - u)
+        h = min(self.height, py - v)
+        for x, tu, tw in ((0, u, w), (w, 0, self.width - w)):
+            for y, tv, th in ((0, v, h), (h, 0, self.height - h)):
+                if tw > 0 and th > 0:
+                    pyxel.blt(x, y, self.tile, tu, tv, tw, th)
+
     def draw(self):
-        self.cls(1)
-        for i, (x, y) in enumerate(self.positions):
-            draw_text_with_border(x, y, self.word, i, (8 + i) % 16, font)
+        if self.use_tile:
+            self.blt_tile()
+        else:
+            self.cls(1)
+            for i, (x, y) in enumerate(self.positions()):
+                draw_text_with_border(x, y, self.word, i, (8 + i) % 16, font)
         pyxel.rect(20, 20, self.width - 40, self.height - 40, 0)
         pyxel.rectb(20, 20, self.width - 40, self.height - 40, 2)
         pyxel.text(30, 30, "Diagonal Scroll", 7)
+        pyxel.text(30, 40, f"T: Tile {'ON' if self.use_tile else 'OFF'}", 7)
         pyxel.text(5, self.height - 10, f"FPS: {self.fps}", 13)
 
 
 def draw_text_with_border(x, y, s, col, bcol, font):
-    for dx in range(-1, 2):
-        for dy in range(-1, 2):
-            if dx != 0 or dy != 0:
-                pyxel.text(
-                    x + dx,
-                    y + dy,
-                    s,
-                    bcol,
-                    font,
-                )
-    pyxel.text(x, y, s, col, font)
+    # 縁取り文字は画像にキャッシュして、画面へは blt 1回で描画する
+    textcache.draw_text_with_border(pyxel, x, y, s, col, bcol, font)
 
 
 if __name__ == "__main__":
     pyxel.init(App.width, App.height, TITLE, fps=60)
     app = App()
     # run forever
-    pyxel.run(app.update, app.draw)
+    pyxel.run(*app.fps.wrap(app.update, app.draw))
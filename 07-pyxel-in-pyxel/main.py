@@ -12,40 +12,17 @@
 # ]
 # ///
 
-import time
+import array
 import pyxel
 
-TITLE = "Pyxel app 07-pyxel-in-pyxel"
-
-font = pyxel.Font("assets/umplus_j12r.bdf")
-
-
-class FPS:
-    def __init__(self):
-        self.value = 0
-        self.frame_times = [time.time()] * 30
-
-    def calc(self):
-        self.frame_times.append(time.time())
-        self.frame_times.pop(0)
-        # 10フレームごとにFPSを計算
-        if pyxel.frame_count % 10:
-            return
-        self.value = int(
-            len(self.frame_times) / (self.frame_times[-1] - self.frame_times[0])
-        )
+import perf
+import tracer
+from textcache import draw_text_with_border
 
-    def __rmul__(self, other):
-        return self.value * other
-
-    def __rtruediv__(self, other):
-        return other / self.value
-
-    def __floordiv__(self, other):
-        return self.value // other
+TITLE = "Pyxel app 07-pyxel-in-pyxel"
 
-    def __str__(self):
-        return str(self.value)
+# fontsubset.py で生成した、使用する文字だけのサブセット
+font = pyxel.Font("assets/umplus_j12r.subset.bdf")
 
 
 class ChildApp:
@@ -58,30 +35,41 @@ class ChildApp:
         self.lh = 15  # line height
         self.wpl = self.width // ww + 2  # word per line
         self.lc = self.height // self.lh + 1  # line count
-        self.fps = FPS()
-        self.positions = []
+        self.fps = perf.FPS("child")
+        self.update, self.render = self.fps.wrap(self.update, self.render)
+        # 単語の初期位置を配列で持ち、全単語共通のスクロール量を足して周期で折り返す
+        # x: -ww 〜 wpl*ww-ww, y: -lh 〜 height の範囲を周回する
+        self.period_x = self.wpl * ww
+        self.period_y = self.height + self.lh + 1
+        self.base_x = array.array("i")
+        self.base_y = array.array("i")
         for i in range(self.wpl * self.lc):
             col = i % self.wpl
             row = i // self.wpl
-            x = col * ww - row * ww // 7
-            y = row * self.lh
-            self.positions.append((x, y))
-        self.frame_times = [time.time()] * 30
+            self.base_x.append(col * ww - row * ww // 7 + ww)
+            self.base_y.append(row * self.lh + self.lh)
+        self.scroll_x = 0
+        self.scroll_y = 0
 
+    @tracer.scoped("child.update")
     def update(self):
-        self.fps.calc()
-        for i, (x, y) in enumerate(self.positions):
-            x, y = (x - 1, y + 1)
-            if x < -font.text_width(self.word):
-                x += self.wpl * self.ww
-            if y > self.height:
-                y = -self.lh
-            self.positions[i] = (x, y)
-
+        # 全単語が同じだけ動くので、スクロール量だけを進める
+        self.scroll_x = (self.scroll_x - 1) % self.period_x
+        self.scroll_y = (self.scroll_y + 1) % self.period_y
+
+    def positions(self):
+        """各単語の現在位置 (x, y) を順に返す"""
+        sx, sy = self.scroll_x, self.scroll_y
+        px, py = self.period_x, self.period_y
+        ww, lh = self.ww, self.lh
+        for x, y in zip(self.base_x, self.base_y):
+            yield (x + sx) % px - ww, (y + sy) % py - lh
+
+    @tracer.scoped("child.render")
     def render(self):
         img = self.img
         img.cls(1)
-        for i, (x, y) in enumerate(self.positions):
+        for i, (x, y) in enumerate(self.positions()):
             draw_text_with_border(img, x, y, self.word, i, (8 + i) % 16, font)
         img.rect(20, 20, self.width - 40, self.height - 40, 0)
         img.rectb(20, 20, self.width - 40, self.height - 40, 2)
@@ -94,20 +82,6 @@ class ChildApp:
         pyxel.blt(0, 0, img, 0, 0, img.width, img.height)
 
 
-def draw_text_with_border(img, x, y, s, col, bcol, font):
-    for dx in range(-1, 2):
-        for dy in range(-1, 2):
-            if dx != 0 or dy != 0:
-                img.text(
-                    x + dx,
-                    y + dy,
-                    s,
-                    bcol,
-                    font,
-                )
-    img.text(x, y, s, col, font)
-
-
 class ParentApp:
     def __init__(self):
         self.child = ChildApp(width=320, height=240, word="Hello, Pyxel!")
@@ -115,13 +89,13 @@ class ParentApp:
         self.move_child = True
         self.parent_count = 0
         self.child_camera = (0, 0)
-        self.fps = FPS()
+        self.fps = perf.FPS("07-pyxel-in-pyxel", overlay=perf.OVERLAY)
         pyxel.init(480, 320, "Pyxel in Pyxel")
         # run forever
-        pyxel.run(self.update, self.draw)
+        pyxel.run(*self.fps.wrap(self.update, self.draw))
 
+    @tracer.scoped("parent.update")
     def update(self):
-        self.fps.calc()
         if pyxel.btnp(pyxel.KEY_F1):
             self.move_parent = not self.move_parent
         if pyxel.btnp(pyxel.KEY_F2):
@@ -144,6 +118,7 @@ class ParentApp:
             )
             self.child_camera = (-x, -y)
 
+    @tracer.scoped("parent.draw")
     def draw(self):
         pyxel.camera(0, 0)
         pyxel.cls(0)
@@ -0,0 +1 @@
+../common/perf.py
\ No newline at end of file
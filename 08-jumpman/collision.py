@@ -0,0 +1 @@
+../common/collision.py
\ No newline at end of file
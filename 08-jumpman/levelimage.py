@@ -0,0 +1 @@
+../common/levelimage.py
\ No newline at end of file
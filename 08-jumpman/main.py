@@ -14,24 +14,31 @@
 
 import pyxel
 
+import chunks
+import collision
+import levelimage
+import replay
+import tracer
+
 TRANSPARENT_COLOR = 2
 SCROLL_BORDER_X = 80
 TILE_FLOOR = (1, 0)
 WALL_TILE_X = 4
-
-scroll_x = 0
-_height = 0
-player = None
-is_loose = False
-show_bb = False
-is_pback = False
+# 当たり判定用のタイルのフラグ
+SOLID = 1
+FLOOR = 2
+LEVEL_ROWS = 32  # タイルマップで使っている行数
 
 
-def get_tile(tile_x, tile_y):
-    return pyxel.tilemaps[0].pget(tile_x, tile_y)
+def classify_tile(tile):
+    if tile[0] >= WALL_TILE_X:
+        return SOLID
+    if tile == TILE_FLOOR:
+        return FLOOR
+    return 0
 
 
-def is_colliding(x, y, is_falling, use_loose=False):
+def is_colliding(world, x, y, is_falling, use_loose=False):
     x1 = pyxel.floor(x) // 8
     y1 = pyxel.floor(y) // 8
     x2 = (pyxel.ceil(x) + 7) // 8
@@ -40,40 +47,41 @@ def is_colliding(x, y, is_falling, use_loose=False):
         x1 = (pyxel.floor(x) + 4) // 8
         x2 = (pyxel.ceil(x) + 3) // 8
 
-    for yi in range(y1, y2 + 1):
-        for xi in range(x1, x2 + 1):
-            if get_tile(xi, yi)[0] >= WALL_TILE_X:
-                return True
+    tiles = world.tiles
+    if tiles.any(x1, y1, x2, y2, SOLID):
+        return True
     if use_loose:
         return False
 
     if is_falling and y % 8 == 1:
-        for xi in range(x1, x2 + 1):
-            if get_tile(xi, y1 + 1) == TILE_FLOOR:
-                return True
+        return tiles.any(x1, y1 + 1, x2, y1 + 1, FLOOR)
     return False
 
 
-def push_back(x, y, dx, dy):
-    for _ in range(pyxel.ceil(abs(dy))):
-        step = max(-1, min(1, dy))
-        if dy > 0 and is_colliding(x, y + step, dy > 0):
-            break
-        elif dy < 0 and is_colliding(x, y + step, dy > 0, use_loose=is_loose):
-            break
-        y += step
-        dy -= step
-    for _ in range(pyxel.ceil(abs(dx))):
-        step = max(-1, min(1, dx))
-        if is_colliding(x + step, y, dy > 0):
-            break
-        x += step
-        dx -= step
+@tracer.scoped("collision")
+def push_back(world, x, y, dx, dy):
+    # 1pxずつ is_colliding で調べながら動かすのと同じ結果を、入るタイルだけ調べて求める
+    tiles = world.tiles
+    if dy > 0:
+        step = collision.sweep_y(tiles, x // 8, (x + 7) // 8, y, dy, SOLID, FLOOR)
+    elif world.is_loose:
+        # 上に動くときは、looseモードなら中央の列だけで判定する
+        step = collision.sweep_y(tiles, (x + 4) // 8, (x + 3) // 8, y, dy, SOLID)
+    else:
+        step = collision.sweep_y(tiles, x // 8, (x + 7) // 8, y, dy, SOLID)
+    y += step
+    dy -= step
+    # 落下中に足場にぶつかったら、足場には横からも入れない
+    x += collision.sweep_x(tiles, x, y, dx, SOLID, FLOOR if dy > 0 else 0)
     return x, y
 
 
 class Player:
-    def __init__(self, x, y, img):
+    # snapshot に含める属性
+    STATE = ("x", "y", "dx", "dy", "direction", "is_falling", "frame_count")
+
+    def __init__(self, world, x, y, img):
+        self.world = world
         self.img = img
         self.x = x
         self.y = y
@@ -83,9 +91,17 @@ class Player:
         self.is_falling = False
         self.frame_count = 0
 
+    def snapshot(self) -> dict:
+        return {name: getattr(self, name) for name in self.STATE}
+
+    def restore(self, snapshot: dict):
+        for name in self.STATE:
+            setattr(self, name, snapshot[name])
+
+    @tracer.scoped("player.update")
     def update(self):
+        world = self.world
         self.frame_count = pyxel.frame_count
-        global scroll_x
         last_y = self.y
         if pyxel.btn(pyxel.KEY_LEFT):
             self.dx = -1 * (2 if pyxel.btn(pyxel.KEY_SHIFT) else 1)
@@ -97,20 +113,20 @@ class Player:
         if pyxel.btnp(pyxel.KEY_SPACE):
             if self.dy == 3 and not self.is_falling:  # 落下3で落ちていない状態
                 self.dy = -7
-        self.x, self.y = push_back(self.x, self.y, self.dx, self.dy)
+        self.x, self.y = push_back(world, self.x, self.y, self.dx, self.dy)
 
         # 頭をぶつけたら上昇を止める
         if self.dy <= 0 and self.y == last_y:
             self.dy = 0
 
         # looseモードでの、ブロックハマりからの押し戻し処理
-        if is_pback and is_colliding(self.x, self.y, False):
+        if world.is_pback and is_colliding(world, self.x, self.y, False):
             shift_x = round(self.x / 8) * 8 - self.x  # 近い方のタイルにずらす
             shift_x = max(-1, min(1, shift_x))  # ずらす量を-1, 0, 1に制限
             # 全てのdxについて、スクロール内で、かつ、ぶつかっていないdxがあるか
             for dx in (-4, 4):
-                if self.x + dx > scroll_x and not is_colliding(
-                    self.x + dx, self.y, False
+                if self.x + dx > world.scroll_x and not is_colliding(
+                    world, self.x + dx, self.y, False
                 ):
                     self.x += shift_x
                     break
@@ -118,24 +134,24 @@ class Player:
                 # ハマっているので右方向にずらす
                 self.x += 1
 
-        if self.x < scroll_x:
-            self.x = scroll_x
+        if self.x < world.scroll_x:
+            self.x = world.scroll_x
         if self.y < 0:
             self.y = 0
         self.dx = int(self.dx * 0.8)
         self.is_falling = self.y > last_y
 
-        if self.x > scroll_x + SCROLL_BORDER_X:
-            scroll_x = min(self.x - SCROLL_BORDER_X, 240 * 8)
-        if self.y >= _height:
-            game_over()
+        if self.x > world.scroll_x + SCROLL_BORDER_X:
+            world.scroll_x = min(self.x - SCROLL_BORDER_X, 240 * 8)
+        if self.y >= world.height:
+            world.game_over()
 
     def draw(self):
         u = (2 if self.is_falling else self.frame_count // 3 % 2) * 8
         w = 8 if self.direction > 0 else -8
         self.img.blt(self.x, self.y, 0, u, 24, w, 8, TRANSPARENT_COLOR)
-        if show_bb:
-            if is_loose:
+        if self.world.show_bb:
+            if self.world.is_loose:
                 self.img.trib(
                     self.x + 4, self.y, self.x, self.y + 7, self.x + 7, self.y + 7, 14
                 )
@@ -143,69 +159,142 @@ class Player:
                 self.img.rectb(self.x, self.y, 8, 8, 10)
 
 
+class World:
+    """1人分のゲームの状態 (スクロール、モード、プレイヤー、当たり判定のフラグ)
+
+    モジュールのグローバル変数ではなくここに持つので、1つのプロセスで複数のゲームを
+    同時に動かせる。snapshot() は pickle できる値だけで状態を返し、restore() で戻す。
+    """
+
+    def __init__(self, width, height, img, level_image=None):
+        """level_image: 描くときの levelimage.LevelImage。当たり判定と同じチャンクを読み込む"""
+        self.width = width
+        self.height = height
+        self.scroll_x = 0
+        self.is_loose = False
+        self.show_bb = False
+        self.is_pback = False
+
+        # 当たり判定はタイルマップを読み出したフラグで行う。
+        # 画面の近くのチャンクだけ読み込み、スクロールして離れたら捨てる
+        tilemap = pyxel.tilemaps[0]
+        self.tiles = collision.TileFlags(tilemap, classify_tile, height=LEVEL_ROWS)
+        self.level_image = level_image
+        self.chunks = chunks.Chunks(
+            self.load_chunk, self.unload_chunk, limit=tilemap.width // chunks.WIDTH
+        )
+        self.load_chunks()
+
+        self.player = Player(self, 0, 30, img)
+
+    def load_chunk(self, cx):
+        self.tiles.load(cx)
+        if self.level_image is not None:
+            self.level_image.load(cx)
+
+    def unload_chunk(self, cx, data):
+        if self.level_image is not None:
+            self.level_image.unload(cx)
+        self.tiles.unload(cx)
+
+    def load_chunks(self):
+        """画面に見えているタイルの列の近くを読み込む"""
+        self.chunks.update(self.scroll_x // 8, (self.scroll_x + self.width - 1) // 8)
+
+    def update(self):
+        if pyxel.btnp(pyxel.KEY_1):
+            self.show_bb = not self.show_bb
+        elif pyxel.btnp(pyxel.KEY_2):
+            self.is_loose = not self.is_loose
+        elif pyxel.btnp(pyxel.KEY_3):
+            self.is_pback = not self.is_pback
+        elif pyxel.btnp(pyxel.KEY_4):
+            self.game_over()
+        self.load_chunks()
+        self.player.update()
+
+    def game_over(self):
+        self.scroll_x = 0
+        self.player.x = 0
+        self.player.y = 30
+        self.player.dx = 0
+        self.player.dy = 0
+
+    def snapshot(self) -> dict:
+        return {
+            "scroll_x": self.scroll_x,
+            "is_loose": self.is_loose,
+            "show_bb": self.show_bb,
+            "is_pback": self.is_pback,
+            "player": self.player.snapshot(),
+        }
+
+    def restore(self, snapshot: dict):
+        self.scroll_x = snapshot["scroll_x"]
+        self.is_loose = snapshot["is_loose"]
+        self.show_bb = snapshot["show_bb"]
+        self.is_pback = snapshot["is_pback"]
+        self.player.restore(snapshot["player"])
+        self.load_chunks()
+
+
 class App:
     def __init__(self, width, height):
         self.width = width
         self.height = height
-        global _height
-        _height = height
         self.img = pyxel.Image(width, height)
         pyxel.load("assets/08-jumpman.pyxres")
 
         # Change enemy spawn tiles invisible
         pyxel.images[0].rect(0, 8, 24, 8, TRANSPARENT_COLOR)
 
-        global player
-        player = Player(0, 30, self.img)
+        # レベルは描いておいた画像を blt する
+        tilemap = pyxel.tilemaps[0]
+        self.level_image = levelimage.LevelImage(tilemap, LEVEL_ROWS, TRANSPARENT_COLOR)
+        self.world = World(width, height, self.img, self.level_image)
 
+    @tracer.scoped("jumpman.update")
     def update(self):
-        global is_loose, show_bb, is_pback
-        if pyxel.btnp(pyxel.KEY_1):
-            show_bb = not show_bb
-        elif pyxel.btnp(pyxel.KEY_2):
-            is_loose = not is_loose
-        elif pyxel.btnp(pyxel.KEY_3):
-            is_pback = not is_pback
-        elif pyxel.btnp(pyxel.KEY_4):
-            game_over()
-        player.update()
+        self.world.update()
 
+    @tracer.scoped("jumpman.render")
     def render(self):
+        world = self.world
         g = self.img
         g.cls(0)
 
         # Draw level
         g.camera()
-        g.bltm(0, 0, 0, scroll_x, 0, 128, 128, TRANSPARENT_COLOR)
-        g.text(1, 1, "1:BBox", 7 if show_bb else 5)
-        g.text(32, 1, "2:Loose", 7 if is_loose else 5)
-        g.text(68, 1, "3:PBack", 7 if is_pback else 5)
+        self.level_image.draw(g, world.scroll_x, 0, 128, 128)
+        g.text(1, 1, "1:BBox", 7 if world.show_bb else 5)
+        g.text(32, 1, "2:Loose", 7 if world.is_loose else 5)
+        g.text(68, 1, "3:PBack", 7 if world.is_pback else 5)
         g.text(104, 1, "4:RST", 5)
 
         # Draw characters
-        g.camera(scroll_x, 0)
-        player.draw()
+        g.camera(world.scroll_x, 0)
+        world.player.draw()
         return g
 
 
-def game_over():
-    global scroll_x
-    scroll_x = 0
-    player.x = 0
-    player.y = 30
-    player.dx = 0
-    player.dy = 0
-
-
 class ParentApp:
     def __init__(self):
         pyxel.init(128, 96, title="jumpman")
+        # PYXEL_RECORD / PYXEL_REPLAY で入力を記録・再生する
+        self.input = replay.Input(
+            (
+                pyxel.KEY_LEFT, pyxel.KEY_RIGHT, pyxel.KEY_SHIFT, pyxel.KEY_SPACE,
+                pyxel.KEY_1, pyxel.KEY_2, pyxel.KEY_3, pyxel.KEY_4,
+            )
+        )
         self.child = App(width=128, height=96)
-        pyxel.run(self.update, self.draw)
+        pyxel.run(self.input.wrap(self.update), self.draw)
 
+    @tracer.scoped("parent.update")
     def update(self):
         self.child.update()
 
+    @tracer.scoped("parent.draw")
     def draw(self):
         g = self.child.render()
         pyxel.blt(
@@ -5,9 +5,19 @@
 # license: MIT
 # version: 1.0
 
+import array
+import os
+
 import pyxel
 
+import pool
+import replay
+import spatial
+
 TRANSPARENT_COLOR = 2
+BACKGROUND_COLOR = 14
+# ミュータンスの実装: "object" は Mutan オブジェクト、"array" は状態ごとの配列
+BACKEND = os.environ.get("MUTANS_BACKEND", "object")
 TOOTH_LIST = [
     (2, 3),
     (16, 3),
@@ -26,31 +36,75 @@ TOOTH_LIST = [
 ]
 
 
-class Tooth:
-    def __init__(self, x, y):
-        self.x = x
-        self.y = y
-        self.damage_count = 0
-
-    def get_location(self):
-        return self.x, self.y
-
-    def damage(self):
-        self.damage_count += 1
-
-    @property
-    def stage(self):
-        stage = min(self.damage_count // 300, 4)
-        return stage
-
-    def is_broken(self):
-        return self.damage_count >= 300 * 5
+class Teeth:
+    """歯のダメージをタイルごとの配列で持ち、歯を描いた背景を画像にキャッシュする
+
+    ダメージの段階が描いてある段階から変わった歯のタイルだけを画像に描き直すので、
+    歯の数が増えてもフレームごとの処理はダメージの残っている歯の数で済む。
+    段階は draw で比べるので、食べられて回復した歯のように同じフレームの中で
+    段階が行き来しても描き直さない。
+    """
+
+    STAGE_DAMAGE = 300  # 1段階のダメージ
+    BROKEN_DAMAGE = 300 * 5  # 折れるダメージ
+
+    def __init__(self, locations, width=20, height=15):
+        self.width = width
+        self.height = height
+        self.damage = array.array("i", bytes(4 * width * height))  # タイル番号: ダメージ
+        self.stage = bytearray(width * height)  # タイル番号: 描いてある段階
+        self.exists = bytearray(width * height)  # タイル番号: 歯があれば 1
+        self.damaged = {}  # ダメージの残っている歯のタイル番号: None (追加した順)
+        self.tiles = {}  # 歯のあるタイル座標: タイル番号
+        self.image = pyxel.Image(width * 8, height * 8)
+        self.image.cls(BACKGROUND_COLOR)
+        for x, y in locations:
+            i = y * width + x
+            self.exists[i] = 1
+            self.tiles[x, y] = i
+            self.draw_tile(i)
+
+    def __len__(self) -> int:
+        return len(self.tiles)
+
+    def bite(self, i):
+        """タイル i (tiles の値) の歯にダメージを与える"""
+        d = self.damage[i] = self.damage[i] + 1
+        self.damaged[i] = None
+        if d >= self.BROKEN_DAMAGE:
+            self.exists[i] = 0
+            self.damage[i] = 0
+            del self.damaged[i]
+            del self.tiles[i % self.width, i // self.width]
+            self.draw_tile(i)
 
     def update(self):
-        self.damage_count = max(self.damage_count - 1, 0)
+        """ダメージの残っている歯を1ずつ回復させる"""
+        damage = self.damage
+        for i in list(self.damaged):
+            d = damage[i] = damage[i] - 1
+            if d == 0:
+                del self.damaged[i]
+                if self.stage[i]:
+                    self.draw_tile(i)  # draw されずに回復しきった
+
+    def draw_tile(self, i):
+        """タイル i を今のダメージの段階で画像に描き直す"""
+        x, y = i % self.width * 8, i // self.width * 8
+        self.image.rect(x, y, 8, 8, BACKGROUND_COLOR)
+        if self.exists[i]:
+            stage = self.stage[i] = min(self.damage[i] // self.STAGE_DAMAGE, 4)
+            self.image.blt(x, y, 0, 8 * stage, 8, 8, 8, TRANSPARENT_COLOR)
+        else:
+            self.stage[i] = 0
 
     def draw(self):
-        pyxel.blt(self.x*8, self.y*8, 0, 8*self.stage, 8, 8, 8, TRANSPARENT_COLOR)
+        damage, stage, stage_damage = self.damage, self.stage, self.STAGE_DAMAGE
+        for i in self.damaged:
+            if min(damage[i] // stage_damage, 4) != stage[i]:
+                self.draw_tile(i)
+        image = self.image
+        pyxel.blt(0, 0, image, 0, 0, image.width, image.height)
 
 
 class Mutan:
@@ -65,10 +119,9 @@ class Mutan:
     def get_location(self):
         return (self.x + 4) // 8, (self.y + 4) // 8
 
-    def eat(self, tooth: Tooth):
+    def eat(self):
         self.direction = 0
         self.energy += 1
-        tooth.damage()
 
     def can_zousyoku(self):
         return self.energy >= 200
@@ -127,12 +180,6 @@ class Brush:
     def get_location(self):
         return (self.x + 4) // 8, (self.y + 4) // 8
 
-    def attach(self, mutan: Mutan):
-        if not self.is_brushing:
-            return
-        if mutan.get_location() == self.get_location():
-            mutan.damage()
-
     def update(self):
         self.is_brushing = pyxel.btn(pyxel.KEY_SPACE)
         speed = 1 if self.is_brushing else 2
@@ -153,66 +200,255 @@ class Brush:
         pyxel.blt(self.x, self.y, 0, u, 24, 8, 16, TRANSPARENT_COLOR)
 
 
+class MutanList:
+    """ミュータンスを Mutan オブジェクトで持つ"""
+
+    def __init__(self):
+        # 追加と削除はフレームの最後 (flush) にまとめて反映する
+        self.pool = pool.Pool()
+        # ミュータンスの居るタイル。ブラシの当たり判定で全数を調べないようにする
+        self.grid = spatial.Grid()
+
+    def __len__(self) -> int:
+        return len(self.pool)
+
+    def spawn(self, x, y):
+        """ミュータンスを追加する。増えるのはフレームの最後"""
+        self.add(Mutan(x, y))
+
+    def add(self, mutan: Mutan):
+        self.grid.insert(mutan)
+        self.pool.spawn(mutan)
+
+    def update(self):
+        for mutan in self.pool:
+            mutan.update()
+        self.grid.move_all(self.pool)
+
+    def brush(self, location):
+        """location のタイルにいるミュータンスを全て磨く"""
+        for mutan in self.grid.at(location):
+            mutan.damage()
+
+    def eat(self, teeth: Teeth) -> int:
+        """磨かれて力尽きたミュータンスを取り除き、残りは歯を食べて増える
+
+        戻り値: 取り除いたミュータンスの数
+        """
+        tiles = teeth.tiles
+        removed = 0
+        for i, mutan in enumerate(self.pool):
+            if mutan.is_broken():
+                self.pool.despawn(self.pool.handle_at(i))
+                self.grid.remove(mutan)
+                removed += 1
+                continue
+            tile = tiles.get(mutan.get_location())
+            if tile is not None:
+                teeth.bite(tile)
+                mutan.eat()
+                if mutan.can_zousyoku():
+                    self.add(mutan.zousyoku())
+        return removed
+
+    def flush(self):
+        self.pool.flush()
+
+    def draw(self):
+        for mutan in self.pool:
+            mutan.draw()
+
+
+class MutanArrays:
+    """ミュータンスの状態を項目ごとの配列で持ち、処理ごとに全数をまとめて計算する
+
+    乱数を使う順番を含めて MutanList と同じ結果になる。並び順も MutanList
+    (pool.Pool) と同じく、追加は末尾に、削除は最後の要素を空いた位置に移す。
+    """
+
+    def __init__(self):
+        self.x = array.array("i")
+        self.y = array.array("i")
+        # direction: 1: right, -1: left, 0: stop, 2: down, -2: up
+        self.direction = array.array("i")
+        self.energy = array.array("i")
+        self.damaged_at = array.array("i")
+        self.columns = (self.x, self.y, self.direction, self.energy, self.damaged_at)
+        self.spawn_queue = []  # (x, y, direction)
+        self.despawn_queue = []  # 位置
+
+    def __len__(self) -> int:
+        return len(self.x)
+
+    def spawn(self, x, y):
+        """ミュータンスを追加する。増えるのはフレームの最後"""
+        self.spawn_queue.append((x, y, pyxel.rndi(-2, 2)))
+
+    def update(self):
+        xs, ys, directions = self.x, self.y, self.direction
+        frame_count = pyxel.frame_count
+        rndi = pyxel.rndi
+
+        # 移動
+        for i, d in enumerate(directions):
+            if d == 1 or d == -1:
+                x = xs[i] + d
+                xs[i] = 0 if x < 0 else 152 if x > 152 else x
+            elif d == 2 or d == -2:
+                y = ys[i] + d // 2
+                ys[i] = 0 if y < 0 else 112 if y > 112 else y
+
+        # 画面の外 (増えた直後) にいたら向きを反転
+        for i, (x, y) in enumerate(zip(xs, ys)):
+            if x < 0 or x > 152 or y < 0 or y > 112:
+                directions[i] = -directions[i]
+
+        # ランダムに向きを変える
+        for i in range(len(directions)):
+            if frame_count % rndi(1, 60) == 0:
+                directions[i] = rndi(0, 5) - 2
+
+        # ダメージの表示は15フレームで消す
+        damaged_at = self.damaged_at
+        for i, t in enumerate(damaged_at):
+            if t and frame_count - t > 15:
+                damaged_at[i] = 0
+
+    def brush(self, location):
+        """location のタイルにいるミュータンスを全て磨く"""
+        tx, ty = location
+        energy, damaged_at = self.energy, self.damaged_at
+        frame_count = pyxel.frame_count
+        for i, (x, y) in enumerate(zip(self.x, self.y)):
+            if (x + 4) // 8 == tx and (y + 4) // 8 == ty:
+                energy[i] = max(energy[i] - 10, 0)
+                damaged_at[i] = frame_count
+
+    def eat(self, teeth: Teeth) -> int:
+        """磨かれて力尽きたミュータンスを取り除き、残りは歯を食べて増える
+
+        戻り値: 取り除いたミュータンスの数
+        """
+        xs, ys, directions, energy = self.x, self.y, self.direction, self.energy
+        tiles = teeth.tiles
+        removed = 0
+        for i, e in enumerate(energy):
+            if e <= 0:
+                self.despawn_queue.append(i)
+                removed += 1
+                continue
+            x, y = xs[i], ys[i]
+            tile = tiles.get(((x + 4) // 8, (y + 4) // 8))
+            if tile is not None:
+                teeth.bite(tile)
+                directions[i] = 0
+                energy[i] = e = e + 1
+                if e >= 200:
+                    energy[i] = 100
+                    self.spawn(pyxel.rndi(x - 5, x + 5), pyxel.rndi(y - 5, y + 5))
+        return removed
+
+    def flush(self):
+        """予約した削除と追加を反映する"""
+        columns = self.columns
+        moved = {}  # 最後から移した要素の元の位置: 今の位置
+        origin = {}  # 今の位置: そこへ移した要素の元の位置
+        for i in self.despawn_queue:
+            i = moved.get(i, i)
+            last = len(self.x) - 1
+            if i != last:
+                for column in columns:
+                    column[i] = column[last]
+                j = origin.pop(last, last)
+                moved[j] = i
+                origin[i] = j
+            for column in columns:
+                column.pop()
+        self.despawn_queue.clear()
+
+        for x, y, direction in self.spawn_queue:
+            self.x.append(x)
+            self.y.append(y)
+            self.direction.append(direction)
+            self.energy.append(100)
+            self.damaged_at.append(0)
+        self.spawn_queue.clear()
+
+    def draw(self):
+        frame_count = pyxel.frame_count
+        flash = frame_count % 2 == 0
+        walk_u = (frame_count // 3 % 2) * 8
+        for x, y, d, damaged_at in zip(self.x, self.y, self.direction, self.damaged_at):
+            if damaged_at and flash:
+                pyxel.rect(x, y, 8, 8, 10)
+                continue
+            if d == 0:
+                u = 16
+                w = 8 if (x + 4) // 8 != x // 8 else -8
+            else:
+                u = walk_u
+                w = 8 if d > 0 else -8
+            pyxel.blt(x, y, 0, u, 16, w, 8, TRANSPARENT_COLOR)
+
+
+BACKENDS = {"object": MutanList, "array": MutanArrays}
+
+
 class App:
     def __init__(self):
         pyxel.init(160, 120, "Pyxel app 09-mutans")
         pyxel.load("assets/09-mutans.pyxres")
+        # PYXEL_RECORD / PYXEL_REPLAY で入力を記録・再生する
+        self.input = replay.Input(
+            (
+                pyxel.KEY_LEFT, pyxel.KEY_RIGHT, pyxel.KEY_UP, pyxel.KEY_DOWN,
+                pyxel.KEY_SPACE,
+            )
+        )
         self.reset()
-        pyxel.run(self.update, self.draw)
+        pyxel.run(self.input.wrap(self.update), self.draw)
 
     def reset(self):
         self.brushed_count = 0
-        self.tooths = {(x, y): Tooth(x, y) for x, y in TOOTH_LIST}
-        self.mutans = [
-            Mutan(pyxel.rndi(0, 100), pyxel.rndi(0, 100))
-            for _ in range(5)
-        ]
+        self.teeth = Teeth(TOOTH_LIST)
+        self.mutans = BACKENDS[BACKEND]()
+        for _ in range(5):
+            self.mutans.spawn(pyxel.rndi(0, 100), pyxel.rndi(0, 100))
+        self.mutans.flush()
         self.brush = Brush(72, 50)
 
     def update(self):
         # move
-        for mutan in self.mutans:
-            mutan.update()
-        if not self.tooths:
+        self.mutans.update()
+        if not self.teeth:
             if pyxel.btnp(pyxel.KEY_SPACE):
                 self.reset()
             return
         self.brush.update()
 
         # brushing, mutans eating and zousyoku
-        for mutan in self.mutans:
-            self.brush.attach(mutan)
-            if mutan.is_broken():
-                self.mutans.remove(mutan)
-                self.brushed_count += 1
-                continue
-            if tooth := self.tooths.get(mutan.get_location()):
-                mutan.eat(tooth)
-                if tooth.is_broken():
-                    del self.tooths[tooth.get_location()]
-                if mutan.can_zousyoku():
-                    self.mutans.append(mutan.zousyoku())
+        if self.brush.is_brushing:
+            self.mutans.brush(self.brush.get_location())
+        self.brushed_count += self.mutans.eat(self.teeth)
 
         # recover tooth
-        for tooth in self.tooths.values():
-            tooth.update()
+        self.teeth.update()
 
         # new mutans
         if pyxel.rndf(0, 1) < 0.01 / 10:
-            self.mutans.append(Mutan(pyxel.rndi(0, 160), pyxel.rndi(0, 120)))
+            self.mutans.spawn(pyxel.rndi(0, 160), pyxel.rndi(0, 120))
+
+        self.mutans.flush()
 
     def draw(self):
-        pyxel.cls(14)
-        for tooth in self.tooths.values():
-            tooth.draw()
-        for mutan in self.mutans:
-            mutan.draw()
+        self.teeth.draw()
+        self.mutans.draw()
         self.brush.draw()
 
         pyxel.text(2, 2, f"MUTANS: {len(self.mutans)}", 5)
         pyxel.text(50, 2, f"BRUSHED: {self.brushed_count}", 5)
 
-        if not self.tooths:
+        if not self.teeth:
             text = "GAME OVER!\nPRESS SPACE TO START"
 
             # 色を3フレーム毎に変える
@@ -0,0 +1 @@
+../common/pool.py
\ No newline at end of file
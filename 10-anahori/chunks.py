@@ -0,0 +1 @@
+../common/chunks.py
\ No newline at end of file
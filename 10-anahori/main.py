@@ -5,8 +5,19 @@
 # license: MIT
 # version: 1.0
 
+import array
+
 import pyxel
 
+import chunks
+import collision
+import levelimage
+import navgraph
+import pool
+import replay
+import spatial
+import tracer
+
 TRANSPARENT_COLOR = 2
 SCROLL_BORDER_X = 80
 TILE_FLOOR = (1, 0)
@@ -16,14 +27,13 @@ TILE_BRICK = (4, 2)
 TILE_SPAWN1 = (0, 1)
 TILE_SPAWN2 = (1, 1)
 TILE_SPAWN3 = (2, 1)
-
-scroll_x = 0
-_height = 0
-player = None
-is_loose = False
-show_bb = False
-is_pback = False
-score = 0
+# 当たり判定用のタイルのフラグ
+SOLID = 1
+FLOOR = 2
+RADDER = 4
+LEVEL_ROWS = 32  # タイルマップで使っている行数
+WAKE_MARGIN = 32  # 敵が起きている、画面の外の範囲 (px)
+CHUNK = chunks.WIDTH
 
 
 def dbg(func):
@@ -39,28 +49,26 @@ def dbg(func):
     return wrapper
 
 
-def get_tile(tile_x, tile_y) -> tuple[int, int]:
-    if b := blocks.get((tile_x, tile_y)):
-        # blocks初期化後はこちらで判定
-        return b.current_type
-    return pyxel.tilemaps[0].pget(tile_x, tile_y)
+def classify_tile(tile):
+    if tile[0] >= WALL_TILE_X:
+        return SOLID
+    if tile == TILE_FLOOR:
+        return FLOOR
+    if tile == TILE_RADDER:
+        return RADDER
+    return 0
 
 
-def is_radder(x, y):
+def is_radder(world, x, y):
     x1 = pyxel.floor(x) // 8
     y1 = pyxel.floor(y) // 8
     x2 = (pyxel.ceil(x) + 7) // 8
     y2 = (pyxel.ceil(y) + 7) // 8
 
-    for yi in range(y1, y2 + 1):
-        for xi in range(x1, x2 + 1):
-            if get_tile(xi, yi) == TILE_RADDER:
-                return True
-
-    return False
+    return world.tiles.any(x1, y1, x2, y2, RADDER)
 
 
-def is_colliding(x, y, is_falling, use_radder, use_loose=False):
+def is_colliding(world, x, y, is_falling, use_radder, use_loose=False):
     x1 = pyxel.floor(x) // 8
     y1 = pyxel.floor(y) // 8
     x2 = (pyxel.ceil(x) + 7) // 8
@@ -69,55 +77,56 @@ def is_colliding(x, y, is_falling, use_radder, use_loose=False):
         x1 = (pyxel.floor(x) + 4) // 8
         x2 = (pyxel.ceil(x) + 3) // 8
 
-    for yi in range(y1, y2 + 1):
-        for xi in range(x1, x2 + 1):
-            if get_tile(xi, yi)[0] >= WALL_TILE_X:
-                return True
+    tiles = world.tiles
+    if tiles.any(x1, y1, x2, y2, SOLID):
+        return True
     if use_loose:
         return False
 
     if not use_radder and is_falling and y % 8 == 1:
-        for xi in range(x1, x2 + 1):
-            if get_tile(xi, y1 + 1) in (TILE_FLOOR, TILE_RADDER):
-                return True
+        return tiles.any(x1, y1 + 1, x2, y1 + 1, FLOOR | RADDER)
     return False
 
 
-def push_back(x, y, dx, dy, use_radder):
-    for _ in range(pyxel.ceil(abs(dy))):
-        step = max(-1, min(1, dy))
-        if dy > 0 and is_colliding(x, y + step, dy > 0, use_radder):
-            break
-        elif dy < 0 and is_colliding(x, y + step, dy > 1, use_radder, use_loose=is_loose):
-            break
-        y += step
-        dy -= step
-    for _ in range(pyxel.ceil(abs(dx))):
-        step = max(-1, min(1, dx))
-        if is_colliding(x + step, y, dy > 1, use_radder):
-            break
-        x += step
-        dx -= step
+@tracer.scoped("collision")
+def push_back(world, x, y, dx, dy, use_radder):
+    # 1pxずつ is_colliding で調べながら動かすのと同じ結果を、入るタイルだけ調べて求める
+    # はしごを使っていなければ、床とはしごに上から乗れる
+    tiles = world.tiles
+    floor = 0 if use_radder else FLOOR | RADDER
+    if dy > 0:
+        step = collision.sweep_y(tiles, x // 8, (x + 7) // 8, y, dy, SOLID, floor)
+    elif world.is_loose:
+        # 上に動くときは、looseモードなら中央の列だけで判定する
+        step = collision.sweep_y(tiles, (x + 4) // 8, (x + 3) // 8, y, dy, SOLID)
+    else:
+        step = collision.sweep_y(tiles, x // 8, (x + 7) // 8, y, dy, SOLID)
+    y += step
+    dy -= step
+    # 落下中に床やはしごにぶつかったら、横からも入れない
+    x += collision.sweep_x(tiles, x, y, dx, SOLID, floor if dy > 1 else 0)
     return x, y
 
 
 # @dbg
-def is_wall(x, y, *, include_ladder=False):
-    tile = get_tile(x // 8, y // 8)
-    if tile == TILE_RADDER and include_ladder:
-        return True
-    return tile == TILE_FLOOR or tile[0] >= WALL_TILE_X
+def is_wall(world, x, y):
+    return world.tiles.get(x // 8, y // 8) & (SOLID | FLOOR) != 0
 
 
-def is_in_wall(x, y) -> bool:
-    if is_wall(x, y) or is_wall(x + 7, y):
+def is_in_wall(world, x, y) -> bool:
+    if is_wall(world, x, y) or is_wall(world, x + 7, y):
         return True
-    if is_wall(x, y + 7) or is_wall(x + 7, y + 7):
+    if is_wall(world, x, y + 7) or is_wall(world, x + 7, y + 7):
         return True
     return False
 
 
 class BaseEnemy:
+    # snapshot に含める属性
+    STATE = ("x", "y", "dx", "dy", "direction", "is_alive")
+
+    initial_x: int
+    initial_y: int
     x: int
     y: int
     dx: int
@@ -125,6 +134,18 @@ class BaseEnemy:
     direction: int
     is_alive: bool
 
+    @property
+    def key(self) -> tuple[int, int]:
+        """出現した位置。snapshot で敵を見分ける"""
+        return self.initial_x, self.initial_y
+
+    def snapshot(self) -> dict:
+        return {name: getattr(self, name) for name in self.STATE}
+
+    def restore(self, snapshot: dict):
+        for name in self.STATE:
+            setattr(self, name, snapshot[name])
+
     def update(self):
         pass
 
@@ -136,13 +157,18 @@ class Enemy1(BaseEnemy): pass
 class Enemy3(BaseEnemy): pass
 
 class Enemy2(BaseEnemy):
-    def __init__(self, img, x, y):
+    STATE = BaseEnemy.STATE + ("climb", "is_chasing")
+
+    def __init__(self, world, img, x, y):
+        self.world = world
         self.img = img
         self.initial_x = self.x = x
         self.initial_y = self.y = y
         self.dx = 0
         self.dy = 0
         self.direction = 1
+        self.climb = 0  # はしごを上り下りしている向き (-1: 上, 1: 下)
+        self.is_chasing = False
         self.is_alive = True
 
     def reset(self):
@@ -151,10 +177,13 @@ class Enemy2(BaseEnemy):
         self.dx = 0
         self.dy = 0
         self.direction = 1
+        self.climb = 0
+        self.is_chasing = False
         self.is_alive = True
 
     def is_other_enemy(self, x: int, y: int) -> bool:
-        for enemy in enemies:
+        # 8px 未満の距離にいる敵は、周囲 3x3 タイルのどこかにいる
+        for enemy in self.world.enemies.grid.near((x // 8, y // 8)):
             if enemy is self:
                 continue
             if abs(enemy.x - x) < 8 and abs(enemy.y - y) < 8:
@@ -162,28 +191,70 @@ class Enemy2(BaseEnemy):
         return False
 
     def is_in_wall(self) -> bool:
-        return is_in_wall(self.x, self.y)
+        return is_in_wall(self.world, self.x, self.y)
+
+    def segment(self) -> tuple[int, int] | None:
+        """立っている足場 (左端の列, 右端の列)。落ちている途中なら None"""
+        if self.y % 8:
+            return None
+        nav, ty = self.world.nav, self.y // 8
+        return nav.segment(self.x // 8, ty) or nav.segment((self.x + 7) // 8, ty)
 
     def update(self):
         if self.is_alive and self.is_in_wall():
             self.is_alive = False
-            global score
-            score += 100
+            self.world.score += 100
             return
 
-        self.dx = self.direction
-        self.dy = min(self.dy + 1, 3)
+        # タイルの境目で、流れ場に従ってプレイヤーへ向かう1歩を決める。
+        # 道がなければ、足場を往復する
+        if self.x % 8 == 0 and self.y % 8 == 0:
+            self.is_chasing = self.chase()
+            if not self.is_chasing:
+                self.climb = 0
+        if not self.is_chasing:
+            self.patrol()
+
+        if self.climb:
+            self.dx = 0
+            self.dy = self.climb
+        else:
+            self.dx = self.direction
+            if not self.is_chasing and self.x % 8 == 0 and self.segment() is None:
+                self.dx = 0  # 足場から出たら、列に沿って真下に落ちる
+            self.dy = min(self.dy + 1, 3)
+        self.x, self.y = push_back(
+            self.world, self.x, self.y, self.dx, self.dy, self.climb != 0
+        )
 
-        if is_wall(self.x, self.y + 8) or is_wall(self.x + 7, self.y + 8):
-            if self.direction < 0 and (
-                is_wall(self.x - 1, self.y + 4) or not is_wall(self.x - 1, self.y + 8, include_ladder=True) or self.is_other_enemy(self.x - 1, self.y)
-            ):
-                self.direction = 1
-            elif self.direction > 0 and (
-                is_wall(self.x + 8, self.y + 4) or not is_wall(self.x + 7, self.y + 8, include_ladder=True) or self.is_other_enemy(self.x + 8, self.y)
-            ):
-                self.direction = -1
-        self.x, self.y = push_back(self.x, self.y, self.dx, self.dy, False)
+    def chase(self) -> bool:
+        """いるタイルの流れ場の向きに進む。道がないか、前に他の敵がいれば False"""
+        world = self.world
+        step = world.flow.get(self.y // 8 * world.nav.width + self.x // 8)
+        if step is None:
+            return False
+        dx, dy = step
+        if dx and self.is_other_enemy(self.x - 1 if dx < 0 else self.x + 8, self.y):
+            return False
+        if dx:
+            self.direction = dx
+        self.climb = dy
+        return True
+
+    def patrol(self):
+        """足場に立っていれば、足場の端か他の敵の手前で向きを変える"""
+        segment = self.segment()
+        if segment is None:
+            return
+        left, right = segment
+        if self.direction < 0 and (
+            self.x <= left * 8 or self.is_other_enemy(self.x - 1, self.y)
+        ):
+            self.direction = 1
+        elif self.direction > 0 and (
+            self.x >= right * 8 or self.is_other_enemy(self.x + 8, self.y)
+        ):
+            self.direction = -1
 
     def draw(self):
         if not self.is_alive:
@@ -194,88 +265,252 @@ class Enemy2(BaseEnemy):
         self.img.blt(self.x, self.y, 0, u, 16, w, 8, TRANSPARENT_COLOR)
 
 
-enemies: list[BaseEnemy] = []
+class EnemyManager:
+    """敵を起きている敵と眠っている敵に分けて持つ
 
+    update と draw は起きている敵だけを回す。画面から離れた敵と倒した敵は眠らせ、
+    眠っている生きた敵は、カメラが動いて画面の近くに入ったら起こす。
+    """
 
-def spawn_enemy(img, left_x, right_x):
-    left_x = pyxel.ceil(left_x / 8)
-    right_x = pyxel.floor(right_x / 8)
-    for x in range(left_x, right_x + 1):
-        for y in range(16):
-            tile = get_tile(x, y)
-            if tile == TILE_SPAWN1:
-                enemies.append(Enemy1(img, x * 8, y * 8))
-            elif tile == TILE_SPAWN2:
-                enemies.append(Enemy2(img, x * 8, y * 8))
-            elif tile == TILE_SPAWN3:
-                enemies.append(Enemy3(img, x * 8, y * 8))
+    def __init__(self):
+        # 起きている敵。追加と削除はフレームの最後 (flush) にまとめて反映する
+        self.pool = pool.Pool()
+        self.handles: dict[BaseEnemy, pool.Handle] = {}  # 起きている敵: ハンドル
+        self.dormant: dict[BaseEnemy, None] = {}  # 眠っている敵 (眠った順)
+        # 起きている敵の居るタイル。他の敵とぶつかるかを全数を調べずに判定する
+        self.grid = spatial.Grid(key=lambda enemy: (enemy.x // 8, enemy.y // 8))
+        self.window = None  # 前に cull したときの起きている範囲
+
+    def __len__(self) -> int:
+        return len(self.pool)
+
+    def __iter__(self):
+        return iter(self.pool)
+
+    def add(self, enemy: BaseEnemy):
+        """起きている敵として追加する。増えるのは flush の後"""
+        self.handles[enemy] = self.pool.spawn(enemy)
+        self.grid.insert(enemy)
+
+    def remove(self, enemy: BaseEnemy):
+        """敵を捨てる (チャンクを捨てたとき)"""
+        handle = self.handles.pop(enemy, None)
+        if handle is None:
+            del self.dormant[enemy]
+            return
+        self.pool.despawn(handle)
+        self.grid.remove(enemy)
+
+    def sleep(self, enemy: BaseEnemy):
+        self.remove(enemy)
+        self.dormant[enemy] = None
+
+    def wake(self, enemy: BaseEnemy):
+        del self.dormant[enemy]
+        self.add(enemy)
+
+    def cull(self, x1: int, x2: int):
+        """x が x1..x2 の外にいる敵を眠らせ、中にいる眠った生きた敵を起こす"""
+        self.flush()  # 読み込んだチャンクから出した敵も調べる
+        for enemy in self.pool:
+            if not x1 <= enemy.x <= x2:
+                self.sleep(enemy)
+        # 眠っている敵は、範囲が変わらなければ起きることはない
+        if self.window != (x1, x2):
+            self.window = (x1, x2)
+            for enemy in list(self.dormant):
+                if enemy.is_alive and x1 <= enemy.x <= x2:
+                    self.wake(enemy)
+        self.flush()
+
+    def flush(self):
+        self.pool.flush()
 
+    def reset(self):
+        """全ての敵を元の位置に戻して起こす"""
+        for enemy in list(self.dormant):
+            self.wake(enemy)
+        self.flush()
+        for enemy in self.pool:
+            enemy.reset()
+        self.grid.move_all(self.pool)
 
-class Block:
-    def __init__(self, img, x, y, type):
-        self.img = img
-        self.type = type
-        self.x = x
-        self.y = y
-        self.damage = 0
+    def draw(self):
+        for enemy in self.pool:
+            enemy.draw()
 
-    def __repr__(self):
-        return f"Block({self.x=}, {self.y=}, {self.type=}, {self.damage=})"
 
-    def reset(self):
-        self.damage = 0
+class Level:
+    """ブロックの種類と掘ったダメージを、読み込んだチャンクごとの配列で持つ
 
-    @property
-    def is_diggable(self) -> bool:
-        return self.type == TILE_BRICK
+    タイルはタイル番号 (y * width + x) で指し、今のタイルの種類や掘った跡の段階は
+    チャンクの配列から求める。読み込んでいないタイルは掘れないので、タイルマップのまま。
+    毎フレームの処理は掘られている (ダメージが残っている) タイルだけにするので、
+    レベルを広くしても掘った数の分しかかからない。
+    """
 
-    @property
-    def current_type(self) -> tuple[int, int]:
-        if self.is_diggable:
-            return TILE_BRICK if self.damage < 20 else (0, 0)
-        return self.type
-
-    def dig(self) -> bool:
-        if self.is_diggable:
-            if self.damage < 60 and 60 <= self.damage + 3:
-                self.damage = 180
-            elif 60 < self.damage:
-                pass
-            else:
-                self.damage = min(180, self.damage + 3)
-            return True
-        return False
+    def __init__(self, world, height):
+        self.world = world
+        self.tilemap = pyxel.tilemaps[0]
+        self.width = self.tilemap.width
+        self.height = height
+        # チャンク番号: チャンクの中の番号 (y * CHUNK + 列) で引く配列
+        self.types: dict[int, list[tuple[int, int]]] = {}  # タイルマップのタイル
+        self.damage: dict[int, array.array] = {}  # ダメージ
+        self.drawn_stage: dict[int, bytearray] = {}  # world.level_image に描いてある段階
+        self.active = {}  # 掘られているタイル番号: (チャンク番号, チャンクの中の番号) (掘った順)
+
+    def load(self, cx: int):
+        """チャンク cx のタイルを読み込む"""
+        pget, x0 = self.tilemap.pget, cx * CHUNK
+        self.types[cx] = [
+            pget(x0 + x, y) for y in range(self.height) for x in range(CHUNK)
+        ]
+        self.damage[cx] = array.array("i", bytes(4 * CHUNK * self.height))
+        self.drawn_stage[cx] = bytearray(CHUNK * self.height)
+
+    def unload(self, cx: int):
+        """チャンク cx を捨てる。掘った穴は埋まったことにする"""
+        for i in [i for i, (c, _) in self.active.items() if c == cx]:
+            del self.active[i]
+        del self.types[cx], self.damage[cx], self.drawn_stage[cx]
 
-    def update(self):
-        self.damage = min(180, self.damage)
-        self.damage = max(0, self.damage - 1)
+    @property
+    def diggable(self) -> list[int]:
+        """読み込んでいる掘れるブロックのタイル番号"""
+        return [
+            j // CHUNK * self.width + cx * CHUNK + j % CHUNK
+            for cx, types in self.types.items()
+            for j, tile in enumerate(types)
+            if tile == TILE_BRICK
+        ]
+
+    def index(self, tile_x: int, tile_y: int) -> int:
+        """タイル番号。読み込んでいなければ -1"""
+        if 0 <= tile_y < self.height and tile_x >= 0 and tile_x // CHUNK in self.types:
+            return tile_y * self.width + tile_x
+        return -1
+
+    def locate(self, i: int) -> tuple[int, int]:
+        """タイル番号から (チャンク番号, チャンクの中の番号)"""
+        x = i % self.width
+        return x // CHUNK, i // self.width * CHUNK + x % CHUNK
+
+    def is_diggable(self, i: int) -> bool:
+        cx, j = self.locate(i)
+        return self.types[cx][j] == TILE_BRICK
+
+    def current_type(self, i: int) -> tuple[int, int]:
+        cx, j = self.locate(i)
+        tile = self.types[cx][j]
+        if self.damage[cx][j] >= 20 and tile == TILE_BRICK:
+            return (0, 0)
+        return tile
+
+    def get_tile(self, tile_x: int, tile_y: int) -> tuple[int, int]:
+        i = self.index(tile_x, tile_y)
+        if i < 0:
+            return self.tilemap.pget(tile_x, tile_y)
+        return self.current_type(i)
+
+    def stage(self, i: int) -> int:
+        """掘った跡の段階。0: なし, 1-3: 浅い-深い"""
+        cx, j = self.locate(i)
+        damage = self.damage[cx][j]
+        if damage == 0:
+            return 0
+        elif damage <= 20:
+            return 1
+        elif damage <= 40:
+            return 2
+        return 3
 
-    def draw(self):
-        u, v = self.type
-        if self.damage == 0:
-            return
-        elif self.damage <= 20:
-            u += 1
-        elif self.damage <= 40:
-            u += 2
+    def reset(self):
+        for i in list(self.active):
+            self.set_damage(i, 0)
+
+    def snapshot(self) -> dict[int, int]:
+        """掘られているタイル番号: ダメージ (掘った順)"""
+        return {i: self.damage[cx][j] for i, (cx, j) in self.active.items()}
+
+    def restore(self, snapshot: dict[int, int]):
+        self.reset()
+        for i, damage in snapshot.items():
+            self.set_damage(i, damage)
+
+    def set_damage(self, i: int, damage: int):
+        cx, j = self.locate(i)
+        self.damage[cx][j] = damage
+        if damage:
+            self.active[i] = cx, j
         else:
-            u += 3
-        self.img.blt(self.x, self.y, 0, u * 8, v * 8, 8, 8, TRANSPARENT_COLOR)
-
+            self.active.pop(i, None)
+        self.update_sprite(i)
+        self.update_tile(i)
+
+    def dig(self, i: int) -> bool:
+        if not self.is_diggable(i):
+            return False
+        cx, j = self.locate(i)
+        damage = self.damage[cx][j]
+        if damage < 60 and 60 <= damage + 3:
+            damage = 180
+        elif 60 < damage:
+            pass
+        else:
+            damage = min(180, damage + 3)
+        self.set_damage(i, damage)
+        return True
 
-def get_diggable_block(x: int, y: int) -> Block | None:
-    x1, y1 = (x + 4) // 8, (y + 4) // 8
-    b = blocks.get((x1, y1))
-    return b if b and b.is_diggable else None
+    def update(self):
+        """掘った穴を1フレーム分埋める"""
+        for i, (cx, j) in list(self.active.items()):
+            damage = self.damage[cx]
+            d = damage[j] = min(180, damage[j]) - 1
+            if d == 0:
+                del self.active[i]
+            if d == 0 or d == 20 or d == 40:
+                self.update_sprite(i)  # 段階が1つ下がった
+            elif d == 19:
+                self.update_tile(i)  # 掘った穴が埋まった
+
+    def update_sprite(self, i: int):
+        """段階が変わったときだけ、world.level_image のタイルを描き直す"""
+        image = self.world.level_image
+        if image is None:
+            return
+        stage = self.stage(i)
+        cx, j = self.locate(i)
+        drawn_stage = self.drawn_stage[cx]
+        if stage == drawn_stage[j]:
+            return
+        drawn_stage[j] = stage
+        overlay = None
+        if stage:
+            u, v = self.types[cx][j]
+            overlay = 0, (u + stage) * 8, v * 8
+        image.draw_tile(i % self.width, i // self.width, overlay)
 
+    def update_tile(self, i: int):
+        """今のタイルの種類を当たり判定のフラグと敵の移動用のグラフに反映する"""
+        x, y = i % self.width, i // self.width
+        if self.world.tiles.set(x, y, classify_tile(self.current_type(i))):
+            self.world.nav.update(x, y)
 
-def dig_block(x: int, y: int) -> bool:
-    b = get_diggable_block(x, y)
-    return b.dig() if b else False
+    def diggable_at(self, x: int, y: int) -> int | None:
+        """座標 (x, y) に中心が重なる掘れるブロックのタイル番号"""
+        i = self.index((x + 4) // 8, (y + 4) // 8)
+        return i if i >= 0 and self.is_diggable(i) else None
 
 
 class Player:
-    def __init__(self, x, y, img):
+    # snapshot に含める属性
+    STATE = (
+        "x", "y", "dx", "dy", "direction", "is_falling", "use_radder", "frame_count", "is_die",
+    )
+
+    def __init__(self, world, x, y, img):
+        self.world = world
         self.img = img
         self.x = x
         self.y = y
@@ -288,18 +523,25 @@ class Player:
         self.is_die = False
 
     def reset(self):
-        player.x = 0
-        player.y = 14
-        player.dx = 0
-        player.dy = 0
-        player.is_die = False
-        player.use_radder = False
+        self.x = 0
+        self.y = 14
+        self.dx = 0
+        self.dy = 0
+        self.is_die = False
+        self.use_radder = False
+
+    def snapshot(self) -> dict:
+        return {name: getattr(self, name) for name in self.STATE}
+
+    def restore(self, snapshot: dict):
+        for name in self.STATE:
+            setattr(self, name, snapshot[name])
 
     def die(self):
         self.is_die = True
 
     def is_in_wall(self) -> bool:
-        return is_in_wall(self.x, self.y)
+        return is_in_wall(self.world, self.x, self.y)
 
     def update_for_die(self):
         # サインカーブで飛び上がって落ちる
@@ -311,8 +553,8 @@ class Player:
         elif df < 80:
             self.y += 4
             self.use_radder = True
-        elif self.y >= _height:
-            game_over()
+        elif self.y >= self.world.height:
+            self.world.game_over()
 
     def update(self):
         if self.is_die:
@@ -321,21 +563,21 @@ class Player:
             self.die()
             return
 
+        world, level = self.world, self.world.level
         self.frame_count = pyxel.frame_count
-        global scroll_x
         last_y = self.y
 
         is_fal = self.is_falling
-        is_rdr = is_radder(self.x, self.y)
-        diggable_l = not is_fal and get_diggable_block(self.x - 8, self.y + 8)
-        diggable_r = not is_fal and get_diggable_block(self.x + 8, self.y + 8)
+        is_rdr = is_radder(world, self.x, self.y)
+        diggable_l = None if is_fal else level.diggable_at(self.x - 8, self.y + 8)
+        diggable_r = None if is_fal else level.diggable_at(self.x + 8, self.y + 8)
 
-        if diggable_l and pyxel.btn(pyxel.KEY_Z):
+        if diggable_l is not None and pyxel.btn(pyxel.KEY_Z):
             # 左を優先
-            digging = diggable_l.dig()
+            digging = level.dig(diggable_l)
             self.direction = -1
-        elif diggable_r and pyxel.btn(pyxel.KEY_X):
-            digging = diggable_r.dig()
+        elif diggable_r is not None and pyxel.btn(pyxel.KEY_X):
+            digging = level.dig(diggable_r)
             self.direction = 1
         else:
             # 穴掘りしていない場合は移動できる
@@ -357,16 +599,18 @@ class Player:
                 # はしごを使っていない場合は落ちる
                 self.dy = 2
                 self.use_radder = False
-            self.x, self.y = push_back(self.x, self.y, self.dx, self.dy, self.use_radder)
+            self.x, self.y = push_back(
+                world, self.x, self.y, self.dx, self.dy, self.use_radder
+            )
 
         # looseモードでの、ブロックハマりからの押し戻し処理
-        if is_pback and is_colliding(self.x, self.y, False, False):
+        if world.is_pback and is_colliding(world, self.x, self.y, False, False):
             shift_x = round(self.x / 8) * 8 - self.x  # 近い方のタイルにずらす
             shift_x = max(-1, min(1, shift_x))  # ずらす量を-1, 0, 1に制限
             # 全てのdxについて、スクロール内で、かつ、ぶつかっていないdxがあるか
             for dx in (-4, 4):
-                if self.x + dx > scroll_x and not is_colliding(
-                    self.x + dx, self.y, False, False
+                if self.x + dx > world.scroll_x and not is_colliding(
+                    world, self.x + dx, self.y, False, False
                 ):
                     self.x += shift_x
                     break
@@ -374,8 +618,8 @@ class Player:
                 # ハマっているので右方向にずらす
                 self.x += 1
 
-        if self.x < scroll_x:
-            self.x = scroll_x
+        if self.x < world.scroll_x:
+            self.x = world.scroll_x
         if self.y < 0:
             self.y = 0
         self.dx = int(self.dx * 0.8)
@@ -384,8 +628,8 @@ class Player:
 
         # if self.x > scroll_x + SCROLL_BORDER_X:
         #     scroll_x = min(self.x - SCROLL_BORDER_X, 240 * 8)
-        if self.y >= _height:
-            game_over()
+        if self.y >= world.height:
+            world.game_over()
 
     def draw(self):
         if self.use_radder:
@@ -399,8 +643,8 @@ class Player:
             w = 8 if self.direction > 0 else -8
         # u = (0 if self.is_falling else self.frame_count // 3 % 2)
         self.img.blt(self.x, self.y, 0, u * 8, 24, w, 8, TRANSPARENT_COLOR)
-        if show_bb:
-            if is_loose:
+        if self.world.show_bb:
+            if self.world.is_loose:
                 self.img.trib(
                     self.x + 4, self.y, self.x, self.y + 7, self.x + 7, self.y + 7, 14
                 )
@@ -408,105 +652,244 @@ class Player:
                 self.img.rectb(self.x, self.y, 8, 8, 10)
 
 
-blocks: dict[tuple[int, int], Block] = {}
+class World:
+    """1人分のゲームの状態 (スクロール、スコア、プレイヤー、敵、掘ったブロック)
 
+    モジュールのグローバル変数ではなくここに持つので、1つのプロセスで複数のゲームを
+    同時に動かせる。snapshot() は pickle できる値だけで状態を返し、restore() で戻す。
+    """
 
-def init_tiles(img):
-    for ix in range(0, 16):
-        for iy in range(0, 16):
-            tile = get_tile(ix, iy)
-            print(f"{ix=}, {iy=}, {tile=}")
-            x, y = ix * 8, iy * 8
-            blocks[(ix, iy)] = Block(img, x, y, tile)
+    def __init__(self, width, height, img, level_image=None):
+        """level_image: 描くときの levelimage.LevelImage。当たり判定と同じチャンクを読み込む"""
+        self.width = width
+        self.height = height
+        self.img = img
+        self.scroll_x = 0
+        self.is_loose = False
+        self.show_bb = False
+        self.is_pback = False
+        self.score = 0
+
+        # 当たり判定はタイルマップを読み出したフラグで行う
+        tilemap = pyxel.tilemaps[0]
+        self.tiles = collision.TileFlags(tilemap, classify_tile, height=LEVEL_ROWS)
+        self.nav = navgraph.NavGraph(self.tiles, wall=SOLID | FLOOR, ladder=RADDER)
+        self.level_image = level_image
+        self.level = Level(self, LEVEL_ROWS)
+
+        self.enemies = EnemyManager()
+        self.flow: dict[int, tuple[int, int]] = {}  # 敵が追いかける流れ場 (NavGraph.flow)
+        self.flow_target = None  # 流れ場の行き先 (プレイヤーが最後にいたノード)
+        self.player = Player(self, 0, 14, img)
+
+        # タイルは画面の近くのチャンクだけ読み込む。敵は画面に入ったチャンクから出す
+        limit = tilemap.width // CHUNK
+        self.chunks = chunks.Chunks(self.load_chunk, self.unload_chunk, limit=limit)
+        self.spawns = chunks.Chunks(
+            self.spawn_enemies, self.despawn_enemies, margin=0, limit=limit
+        )
+        self.load_chunks()
+
+    def load_chunk(self, cx):
+        self.tiles.load(cx)
+        self.nav.load(cx)
+        if self.level_image is not None:
+            self.level_image.load(cx)
+        self.level.load(cx)
+
+    def unload_chunk(self, cx, data):
+        self.level.unload(cx)
+        if self.level_image is not None:
+            self.level_image.unload(cx)
+        self.tiles.unload(cx)
+        self.nav.unload(cx)
+
+    def load_chunks(self):
+        """画面に見えているタイルの列の近くを読み込む"""
+        x1, x2 = self.scroll_x // 8, (self.scroll_x + self.width - 1) // 8
+        self.chunks.update(x1, x2)
+        self.spawns.update(x1, x2)
+
+    def spawn_enemies(self, cx) -> list[BaseEnemy]:
+        """チャンク cx の出現タイルに敵を出す。出した敵を返す"""
+        spawned = []
+        for x in range(cx * CHUNK, (cx + 1) * CHUNK):
+            for y in range(16):
+                tile = self.level.get_tile(x, y)
+                if tile == TILE_SPAWN1:
+                    spawned.append(Enemy1(self, self.img, x * 8, y * 8))
+                elif tile == TILE_SPAWN2:
+                    spawned.append(Enemy2(self, self.img, x * 8, y * 8))
+                elif tile == TILE_SPAWN3:
+                    spawned.append(Enemy3(self, self.img, x * 8, y * 8))
+        for enemy in spawned:
+            self.enemies.add(enemy)
+        return spawned
+
+    def despawn_enemies(self, cx, spawned: list[BaseEnemy]):
+        for enemy in spawned:
+            self.enemies.remove(enemy)
+
+    def update(self):
+        # if pyxel.btnp(pyxel.KEY_1):
+        #     self.show_bb = not self.show_bb
+        # elif pyxel.btnp(pyxel.KEY_2):
+        #     self.is_loose = not self.is_loose
+        # elif pyxel.btnp(pyxel.KEY_3):
+        #     self.is_pback = not self.is_pback
+        if pyxel.btnp(pyxel.KEY_4):
+            self.game_over()
+        self.load_chunks()
+        with tracer.scope("blocks"):
+            self.level.update()
+        player, enemies = self.player, self.enemies
+        with tracer.scope("player"):
+            player.update()
+        if player.is_die:
+            return
+
+        with tracer.scope("enemies"):
+            self.update_flow()
+            # 画面の近くの敵だけ動かす。離れた敵と倒した敵は眠らせる
+            enemies.cull(
+                self.scroll_x - WAKE_MARGIN, self.scroll_x + self.width + WAKE_MARGIN
+            )
+            for enemy in enemies:
+                if abs(player.x - enemy.x) < 6 and abs(player.y - enemy.y) < 6:
+                    player.die()
+                    break
+                enemy.update()
+                if enemy.y > 160:
+                    enemy.is_alive = False
+                if enemy.is_alive:
+                    enemies.grid.move(enemy)
+                else:
+                    enemies.sleep(enemy)
+            enemies.flush()
+
+    def update_flow(self):
+        """プレイヤーのいるノードへの流れ場を引く。探索はノードかグラフが変わったときだけ"""
+        player, nav = self.player, self.nav
+        i = (player.y + 4) // 8 * nav.width + (player.x + 4) // 8
+        if i in nav.edges:
+            self.flow_target = i
+        self.flow = nav.flow(self.flow_target) if self.flow_target is not None else {}
+
+    def game_over(self):
+        self.scroll_x = 0
+        self.player.reset()
+        self.enemies.reset()
+        self.level.reset()
+
+    def snapshot(self) -> dict:
+        """フレームの間 (update の後) の状態"""
+        enemies = self.enemies
+        return {
+            "scroll_x": self.scroll_x,
+            "is_loose": self.is_loose,
+            "show_bb": self.show_bb,
+            "is_pback": self.is_pback,
+            "score": self.score,
+            "player": self.player.snapshot(),
+            "level": self.level.snapshot(),
+            # 敵は出現した位置で見分ける。起きている敵は update する順に並べる
+            "enemies": [(enemy.key, enemy.snapshot()) for enemy in enemies],
+            "dormant": [(enemy.key, enemy.snapshot()) for enemy in enemies.dormant],
+            "window": enemies.window,
+            "flow_target": self.flow_target,
+        }
+
+    def restore(self, snapshot: dict):
+        self.scroll_x = snapshot["scroll_x"]
+        self.is_loose = snapshot["is_loose"]
+        self.show_bb = snapshot["show_bb"]
+        self.is_pback = snapshot["is_pback"]
+        self.score = snapshot["score"]
+
+        # スクロールした位置のチャンクを読み込み直し、そこから出した敵に状態を戻す
+        self.spawns.clear()
+        self.chunks.clear()
+        self.load_chunks()
+        self.level.restore(snapshot["level"])
+        spawned = {
+            enemy.key: enemy for group in self.spawns.loaded.values() for enemy in group
+        }
+        enemies = self.enemies = EnemyManager()
+        for key, state in snapshot["enemies"]:
+            enemy = spawned[key]
+            enemy.restore(state)
+            enemies.add(enemy)
+        for key, state in snapshot["dormant"]:
+            enemy = spawned[key]
+            enemy.restore(state)
+            enemies.dormant[enemy] = None
+        enemies.flush()
+        enemies.window = snapshot["window"]
+        self.player.restore(snapshot["player"])
+        self.flow_target = snapshot["flow_target"]
 
 
 class App:
     def __init__(self, width, height):
         self.width = width
         self.height = height
-        global _height
-        _height = height
         self.img = pyxel.Image(width, height)
         pyxel.load("assets/10-anahori.pyxres")
 
         # Change enemy spawn tiles invisible
         pyxel.images[0].rect(0, 8, 24, 8, TRANSPARENT_COLOR)
 
-        global player
-        player = Player(0, 14, self.img)
-
-        init_tiles(self.img)
-        spawn_enemy(self.img, 0, 127)
+        # レベルはタイルと掘った跡を描いておいた画像を blt し、段階が変わったブロックだけ描き直す
+        tilemap = pyxel.tilemaps[0]
+        self.level_image = levelimage.LevelImage(tilemap, LEVEL_ROWS, TRANSPARENT_COLOR)
+        self.world = World(width, height, self.img, self.level_image)
 
+    @tracer.scoped("anahori.update")
     def update(self):
-        global is_loose, show_bb, is_pback
-        # if pyxel.btnp(pyxel.KEY_1):
-        #     show_bb = not show_bb
-        # elif pyxel.btnp(pyxel.KEY_2):
-        #     is_loose = not is_loose
-        # elif pyxel.btnp(pyxel.KEY_3):
-        #     is_pback = not is_pback
-        if pyxel.btnp(pyxel.KEY_4):
-            game_over()
-        for b in blocks.values():
-            b.update()
-        player.update()
-        if player.is_die:
-            return
-
-        for enemy in enemies:
-            if not enemy.is_alive:
-                continue
-            if abs(player.x - enemy.x) < 6 and abs(player.y - enemy.y) < 6:
-                player.die()
-                return
-            enemy.update()
-            if enemy.x < scroll_x - 8 or enemy.x > scroll_x + 160 or enemy.y > 160:
-                enemy.is_alive = False
+        self.world.update()
 
+    @tracer.scoped("anahori.render")
     def render(self):
+        world = self.world
         g = self.img
         g.cls(0)
 
         # Draw level
         g.camera()
-        g.bltm(0, 0, 0, scroll_x, 0, 128, 128, TRANSPARENT_COLOR)
-        for b in blocks.values():
-            b.draw()
+        self.level_image.draw(g, world.scroll_x, 0, 128, 128)
         g.text(1, 1, "SCORE:", 5)
-        g.text(24, 1, f"{score:04d}", 7)
-        # g.text(1, 1, "1:BBox", 7 if show_bb else 5)
-        # g.text(32, 1, "2:Loose", 7 if is_loose else 5)
-        # g.text(68, 1, "3:PBack", 7 if is_pback else 5)
+        g.text(24, 1, f"{world.score:04d}", 7)
+        # g.text(1, 1, "1:BBox", 7 if world.show_bb else 5)
+        # g.text(32, 1, "2:Loose", 7 if world.is_loose else 5)
+        # g.text(68, 1, "3:PBack", 7 if world.is_pback else 5)
         g.text(98, 1, "4:RST", 5)
 
         # Draw characters
-        g.camera(scroll_x, 0)
-        player.draw()
-        for enemy in enemies:
-            enemy.draw()
+        g.camera(world.scroll_x, 0)
+        world.player.draw()
+        world.enemies.draw()
         return g
 
 
-def game_over():
-    global scroll_x
-    scroll_x = 0
-    player.reset()
-    for enemy in enemies:
-        enemy.reset()
-    for b in blocks.values():
-        b.reset()
-
-
 class ParentApp:
     def __init__(self):
         pyxel.init(128, 96, title="anahori", fps=20)
+        # PYXEL_RECORD / PYXEL_REPLAY で入力を記録・再生する
+        self.input = replay.Input(
+            (
+                pyxel.KEY_LEFT, pyxel.KEY_RIGHT, pyxel.KEY_UP, pyxel.KEY_DOWN,
+                pyxel.KEY_Z, pyxel.KEY_X,
+                pyxel.KEY_1, pyxel.KEY_2, pyxel.KEY_3, pyxel.KEY_4,
+            )
+        )
         self.child = App(width=128, height=96)
-        pyxel.run(self.update, self.draw)
+        pyxel.run(self.input.wrap(self.update), self.draw)
 
+    @tracer.scoped("parent.update")
     def update(self):
         self.child.update()
 
+    @tracer.scoped("parent.draw")
     def draw(self):
         g = self.child.render()
         pyxel.blt(
@@ -0,0 +1 @@
+../common/navgraph.py
\ No newline at end of file
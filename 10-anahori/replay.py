@@ -0,0 +1 @@
+../common/replay.py
\ No newline at end of file
@@ -0,0 +1 @@
+../common/spatial.py
\ No newline at end of file
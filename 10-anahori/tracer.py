@@ -0,0 +1 @@
+../common/tracer.py
\ No newline at end of file
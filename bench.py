@@ -0,0 +1,295 @@
+# ベンチマーク
+#
+# uv run bench.py                   # 全シナリオを実行して、基準値と比較する
+# uv run bench.py mutans-200        # 指定したシナリオのみ
+# uv run bench.py --update          # 基準値 (bench_baselines.json) を今回の結果で書き換える
+#
+# シナリオごとに headless.py でアプリを決まった入力と乱数のシードで実行し、
+# 1フレームあたりの update と draw の時間を測る。どの回も同じ処理をするので、
+# 繰り返し実行してフレームごとに最小の時間を取り、ほかのプロセスの影響を除く。
+# frame (update + draw) の中央値が基準値を THRESHOLD (既定 25%) 以上、かつ
+# MIN_SLOWDOWN (既定 0.05 ms) 以上超えたシナリオがあれば終了コード 1 を返す。
+# 1フレームが数十μsのシナリオでは、タイマーやスケジューラの揺れだけで比が
+# 1.5 を超えることがあるので、時間の差でも判定する。
+# 必要なファイル (requires) や基準値がなく比較できないシナリオも失敗にする。
+#
+# 基準値は計測したマシンでの値なので、別のマシンで比較するときは先に --update する。
+
+import argparse
+import contextlib
+import dataclasses
+import io
+import json
+import math
+import os
+import sys
+from collections.abc import Callable
+from pathlib import Path
+
+import headless
+
+ROOT = Path(__file__).resolve().parent
+BASELINES = ROOT / "bench_baselines.json"
+THRESHOLD = 0.25
+MIN_SLOWDOWN = 0.05  # ms。これより小さい差は揺れとみなす
+WARMUP = 10  # 集計から除く最初のフレーム数 (フォントや描画キャッシュの準備)
+REPEAT = 5
+
+
+@dataclasses.dataclass
+class Scenario:
+    name: str
+    app_dir: str
+    frames: int
+    tape: str = ""
+    setup: Callable | None = None  # setup(モジュール, アプリ): 最初のフレームの前に呼ぶ
+    requires: tuple[str, ...] = ()  # app_dir からの相対パス。無ければ失敗にする
+    seed: int = 0
+    env: dict[str, str] = dataclasses.field(default_factory=dict)  # 実行中だけ設定する環境変数
+
+
+def app_of(update):
+    """pyxel.run に渡された update から、アプリのインスタンスを探す
+
+    perf.FPS.wrap などで包まれているときは、包んだ関数の update をたどる。
+    """
+    func = update
+    while not hasattr(func, "__self__"):
+        cells = dict(zip(func.__code__.co_freevars, func.__closure__ or ()))
+        if "update" not in cells:
+            raise ValueError(f"cannot find the app from {update!r}")
+        func = cells["update"].cell_contents
+    return func.__self__
+
+
+def typing_tape(frames: int, interval: int = 3) -> str:
+    """a から z を順に interval フレームずつ押す入力テープ"""
+    lines = []
+    for i, frame in enumerate(range(0, frames, interval)):
+        lines.append(f"{frame} KEY_{chr(ord('A') + i % 26)}")
+        lines.append(f"{frame + 1}")
+    return "\n".join(lines)
+
+
+def setup_slide(module, app):
+    # 計測したFPSでページ送りの速さが変わらないよう、30fps 固定とみなす
+    app.fps = 30
+
+
+def setup_mutans(module, app):
+    pyxel = module.pyxel
+    for _ in range(200 - len(app.mutans)):
+        app.mutans.spawn(pyxel.rndi(0, 152), pyxel.rndi(0, 112))
+    app.mutans.flush()
+
+
+def setup_anahori(module, app):
+    # 掘れるブロックを全て掘った状態にする (damage は1フレームに1ずつ戻る)
+    level = app.child.world.level
+    for i in level.diggable:
+        if i % level.width < app.child.width // 8:  # 画面に見えているブロック
+            level.set_damage(i, 180)
+
+
+def setup_typing(module, app):
+    app = app.child
+    words = module.load_words()
+    words = (words * (1000 // len(words) + 2))[:1001]  # WordSet は最後の1語を使わない
+    char_per_line = (app.width - app.width // 10 * 2) // module.CHAR_WIDTH
+    app.wordset = module.WordSet(words, 200, char_per_line)
+    app.start_time = module.time.time()
+    app.started = True
+
+
+SCENARIOS = [
+    Scenario(
+        "slide-pages",
+        "03-slide",
+        frames=400,
+        tape="\n".join(f"{f} KEY_SPACE\n{f + 1}" for f in range(20, 400, 20)),
+        setup=setup_slide,
+    ),
+    Scenario(
+        # 走りながら24フレームごとにジャンプする (穴に落ちると最初から)
+        "jumpman-run",
+        "08-jumpman",
+        frames=600,
+        tape="\n".join(
+            f"{f} KEY_RIGHT+KEY_SHIFT+KEY_SPACE\n{f + 1} KEY_RIGHT+KEY_SHIFT"
+            for f in range(0, 600, 24)
+        ),
+    ),
+    Scenario(
+        "mutans-200",
+        "09-mutans",
+        frames=300,
+        tape="0 KEY_RIGHT\n100 KEY_DOWN\n200 KEY_LEFT",
+        setup=setup_mutans,
+    ),
+    Scenario(
+        "mutans-200-array",
+        "09-mutans",
+        frames=300,
+        tape="0 KEY_RIGHT\n100 KEY_DOWN\n200 KEY_LEFT",
+        setup=setup_mutans,
+        env={"MUTANS_BACKEND": "array"},
+    ),
+    Scenario(
+        # 掘った穴が戻り始める (damage < 20) 前に終える
+        "anahori-dug",
+        "10-anahori",
+        frames=150,
+        tape="0 KEY_RIGHT\n60 KEY_LEFT\n120",
+        setup=setup_anahori,
+    ),
+    Scenario(
+        "typing-1000",
+        "05-typing-filled",
+        frames=300,
+        tape=typing_tape(300),
+        setup=setup_typing,
+    ),
+]
+
+
+def percentile(values, p) -> float:
+    """ソート済みの values の p パーセンタイル (最近傍法)"""
+    i = math.ceil(p / 100 * len(values)) - 1
+    return values[min(max(i, 0), len(values) - 1)]
+
+
+def run(scenario: Scenario) -> headless.HeadlessPyxel:
+    """シナリオを1回実行する"""
+    tape = headless.parse_tape(scenario.tape)
+
+    def setup(module, update, draw):
+        if scenario.setup is not None:
+            scenario.setup(module, app_of(update))
+
+    saved_env = {name: os.environ.get(name) for name in scenario.env}
+    os.environ.update(scenario.env)
+    try:
+        # アプリのデバッグ出力で結果が読みにくくならないようにする
+        with contextlib.redirect_stdout(io.StringIO()):
+            stub = headless.run_app(
+                ROOT / scenario.app_dir, scenario.frames, tape, scenario.seed, setup=setup
+            )
+    finally:
+        for name, value in saved_env.items():
+            if value is None:
+                del os.environ[name]
+            else:
+                os.environ[name] = value
+    if len(stub.update_times) < scenario.frames:
+        raise RuntimeError(
+            f"{scenario.name}: app quit at frame {len(stub.update_times)}"
+        )
+    return stub
+
+
+def measure(scenario: Scenario, repeat: int = REPEAT) -> dict[str, float]:
+    """シナリオを repeat 回実行し、update/draw/frame の p50 と p95 をミリ秒で返す"""
+    update = draw = None
+    for _ in range(max(repeat, 1)):
+        stub = run(scenario)
+        times = stub.update_times[WARMUP:], stub.draw_times[WARMUP:]
+        if update is None:
+            update, draw = times
+        else:
+            update = list(map(min, update, times[0]))
+            draw = list(map(min, draw, times[1]))
+
+    result = {}
+    for kind, values in (
+        ("update", update),
+        ("draw", draw),
+        ("frame", [u + d for u, d in zip(update, draw)]),
+    ):
+        values = sorted(values)
+        result[f"{kind}_p50"] = round(percentile(values, 50) * 1000, 4)
+        result[f"{kind}_p95"] = round(percentile(values, 95) * 1000, 4)
+    return result
+
+
+def load_baselines() -> dict[str, dict[str, float]]:
+    if not BASELINES.exists():
+        return {}
+    return json.loads(BASELINES.read_text(encoding="utf-8"))
+
+
+def save_baselines(baselines: dict[str, dict[str, float]]):
+    text = json.dumps(baselines, indent=2, sort_keys=True)
+    BASELINES.write_text(text + "\n", encoding="utf-8")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="per-frame benchmark of the apps")
+    parser.add_argument("names", nargs="*", help="scenarios to run (default: all)")
+    parser.add_argument("--repeat", type=int, default=REPEAT)
+    parser.add_argument("--threshold", type=float, default=THRESHOLD)
+    parser.add_argument(
+        "--min-slowdown", type=float, default=MIN_SLOWDOWN, help="ms per frame"
+    )
+    parser.add_argument("--update", action="store_true", help="rewrite the baselines")
+    parser.add_argument("--list", action="store_true", help="list the scenarios")
+    args = parser.parse_args()
+
+    if args.list:
+        for s in SCENARIOS:
+            print(f"{s.name:<18} {s.app_dir} ({s.frames} frames)")
+        return
+    unknown = set(args.names) - {s.name for s in SCENARIOS}
+    if unknown:
+        parser.error(f"unknown scenario: {', '.join(sorted(unknown))}")
+    scenarios = [s for s in SCENARIOS if not args.names or s.name in args.names]
+
+    baselines = load_baselines()
+    failed = []
+    print(
+        f"{'scenario':<18} {'update':>8} {'draw':>8} {'frame':>8} "
+        f"{'p95':>8} {'baseline':>9} {'ratio':>6}  (ms)"
+    )
+    for scenario in scenarios:
+        missing = [
+            f for f in scenario.requires if not (ROOT / scenario.app_dir / f).exists()
+        ]
+        if missing:
+            # 計測しないまま終了コード 0 にしない
+            print(f"{scenario.name:<18} FAIL (missing {', '.join(missing)})")
+            failed.append(scenario.name)
+            continue
+
+        result = measure(scenario, args.repeat)
+        line = (
+            f"{scenario.name:<18} {result['update_p50']:8.3f} {result['draw_p50']:8.3f} "
+            f"{result['frame_p50']:8.3f} {result['frame_p95']:8.3f}"
+        )
+        baseline = baselines.get(scenario.name)
+        if baseline is not None:
+            ratio = result["frame_p50"] / baseline["frame_p50"]
+            slowdown = result["frame_p50"] - baseline["frame_p50"]
+            line += f" {baseline['frame_p50']:9.3f} {ratio:6.2f}"
+            if ratio > 1 + args.threshold and slowdown > args.min_slowdown:
+                line += "  SLOW"
+                failed.append(scenario.name)
+        elif not args.update:
+            line += "  NO BASELINE (record it with --update)"
+            failed.append(scenario.name)
+        print(line)
+        if args.update:
+            baselines[scenario.name] = result
+
+    if args.update:
+        save_baselines(baselines)
+        print(f"baselines written to {BASELINES.name}")
+    elif failed:
+        print(
+            f"{len(failed)} scenario(s) failed (missing files, no baseline, or more than "
+            f"{args.threshold:.0%} and {args.min_slowdown} ms over the baseline): "
+            f"{', '.join(failed)}"
+        )
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
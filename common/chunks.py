@@ -0,0 +1,52 @@
+# タイルマップを列ごとのチャンクに分けて、カメラの近くだけ読み込む
+#
+#   level = chunks.Chunks(load, unload, limit=tilemap.width // chunks.WIDTH)
+#   level.update(scroll_x // 8, (scroll_x + width - 1) // 8)   # 見えているタイルの列
+#   level.loaded[cx]                                            # load(cx) が返したデータ
+#
+# チャンクは WIDTH タイル幅の列。見えている列を含むチャンクと、その左右 margin 個を
+# load(チャンク番号) で読み込み、範囲から出たチャンクは unload(チャンク番号, データ) で捨てる。
+# メモリと読み込みの時間は、マップの大きさではなく画面の幅の分だけになる。
+# 同じ範囲で update しても何もしないので、毎フレーム呼んでよい。
+
+WIDTH = 16  # チャンクの幅 (タイル)
+
+
+class Chunks:
+    def __init__(self, load, unload=None, margin=1, limit=None):
+        """limit: チャンクの数 (これ以降は読み込まない)"""
+        self.load = load
+        self.unload = unload
+        self.margin = margin
+        self.limit = limit
+        self.loaded: dict[int, object] = {}  # チャンク番号: load が返したデータ (読み込んだ順)
+        self.window = None  # 読み込んでいるチャンク番号の range
+
+    def __contains__(self, cx: int) -> bool:
+        return cx in self.loaded
+
+    def update(self, x1: int, x2: int):
+        """タイルの列 x1..x2 が見えているとして、チャンクを読み込む・捨てる"""
+        first = max(x1 // WIDTH - self.margin, 0)
+        last = x2 // WIDTH + self.margin
+        if self.limit is not None:
+            last = min(last, self.limit - 1)
+        window = range(first, last + 1)
+        if window == self.window:
+            return
+        self.window = window
+        for cx in [cx for cx in self.loaded if cx not in window]:
+            data = self.loaded.pop(cx)
+            if self.unload is not None:
+                self.unload(cx, data)
+        for cx in window:
+            if cx not in self.loaded:
+                self.loaded[cx] = self.load(cx)
+
+    def clear(self):
+        """全てのチャンクを捨てる"""
+        for cx, data in list(self.loaded.items()):
+            del self.loaded[cx]
+            if self.unload is not None:
+                self.unload(cx, data)
+        self.window = None
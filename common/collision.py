@@ -0,0 +1,204 @@
+# タイルマップの当たり判定用のフラグ
+#
+#   SOLID, FLOOR = 1, 2
+#   def classify(tile):                    # タイル (u, v) のフラグ
+#       return SOLID if tile[0] >= 4 else FLOOR if tile == (1, 0) else 0
+#   tiles = collision.TileFlags(pyxel.tilemaps[0], classify, height=32)
+#   tiles.load(cx)                         # チャンク cx (chunks.WIDTH 列) を読み込む
+#   tiles.get(tx, ty) & SOLID              # 1タイルのフラグ
+#   tiles.any(x1, y1, x2, y2, SOLID)       # 範囲 (両端を含む) のどれかのタイルにフラグがあるか
+#   tiles.set(tx, ty, 0)                   # 掘ったブロックなど、タイルが変わったとき (変わったら True)
+#   tiles.unload(cx)
+#
+#   y += collision.sweep_y(tiles, x // 8, (x + 7) // 8, y, dy, SOLID, FLOOR)
+#   x += collision.sweep_x(tiles, x, y, dx, SOLID)
+#
+# タイルマップはチャンク (chunks.WIDTH 列) ごとに読み込むときに1度だけ読み、
+# タイルごとのフラグを bytearray に持つ。判定では tilemap.pget を呼ばない。
+# any は行ごとのビットマスク (チャンクとフラグごとに初めて使うときに作る) を調べるので、
+# 範囲の幅によらず1行あたり1回の演算で済む。
+# 読み込んでいないチャンクとタイルマップの外は、何もないタイル (フラグ 0) とみなす。
+#
+# sweep_x/sweep_y は 8x8 の箱を1pxずつ動かして重なりを調べるのと同じ結果を、
+# 箱が新しく入るタイルの行 (列) だけを調べて求める。調べる回数は動く距離の
+# 1/8 程度になる。座標と移動量は整数。
+
+import pyxel
+
+import chunks
+
+TILE = 8  # タイルと箱の大きさ (px)
+CHUNK = chunks.WIDTH
+
+
+class Chunk:
+    def __init__(self, flags: bytearray):
+        self.flags = flags  # y * CHUNK + チャンクの中の列: フラグ
+        self.rows: dict[int, list[int]] = {}  # フラグ: 行ごとのビットマスク (ビット x が列 x)
+
+
+class TileFlags:
+    def __init__(self, tilemap: pyxel.Tilemap, classify, height=None):
+        """classify: タイル (u, v) からフラグ (0-255) を返す関数
+        height: 読み込む行数 (省略時はタイルマップの高さ)
+        """
+        self.tilemap = tilemap
+        self.classify = classify
+        self.height = height or tilemap.height
+        self.chunks: dict[int, Chunk] = {}  # チャンク番号: Chunk
+        self.cache = {}  # タイル: フラグ
+
+    def load(self, cx: int) -> Chunk:
+        """チャンク cx のタイルを読み込む"""
+        flags = bytearray(CHUNK * self.height)
+        cache, classify, pget = self.cache, self.classify, self.tilemap.pget
+        i = 0
+        for y in range(self.height):
+            for x in range(cx * CHUNK, (cx + 1) * CHUNK):
+                tile = pget(x, y)
+                flag = cache.get(tile)
+                if flag is None:
+                    flag = cache[tile] = classify(tile)
+                flags[i] = flag
+                i += 1
+        chunk = self.chunks[cx] = Chunk(flags)
+        return chunk
+
+    def unload(self, cx: int, chunk=None):
+        self.chunks.pop(cx, None)
+
+    def get(self, x: int, y: int) -> int:
+        chunk = self.chunks.get(x // CHUNK)
+        if chunk is None or not 0 <= y < self.height:
+            return 0
+        return chunk.flags[y * CHUNK + x % CHUNK]
+
+    def set(self, x: int, y: int, flag: int) -> bool:
+        """タイル (x, y) のフラグを変える。変わったら True
+
+        読み込んでいないチャンクなら何もしない。
+        """
+        chunk = self.chunks.get(x // CHUNK)
+        if chunk is None:
+            return False
+        i = y * CHUNK + x % CHUNK
+        if chunk.flags[i] == flag:
+            return False
+        chunk.flags[i] = flag
+        bit = 1 << x % CHUNK
+        for mask, rows in chunk.rows.items():
+            if flag & mask:
+                rows[y] |= bit
+            else:
+                rows[y] &= ~bit
+        return True
+
+    def any(self, x1: int, y1: int, x2: int, y2: int, mask: int) -> bool:
+        """タイル (x1, y1) から (x2, y2) までのどれかに mask のフラグがあるか"""
+        if x1 < 0:
+            x1 = 0
+        if y1 < 0:
+            y1 = 0
+        if y2 >= self.height:
+            y2 = self.height - 1
+        if x2 < x1:
+            return False
+        cx = x1 // CHUNK
+        while cx * CHUNK <= x2:
+            chunk = self.chunks.get(cx)
+            if chunk is not None:
+                rows = chunk.rows.get(mask)
+                if rows is None:
+                    rows = self._build_rows(chunk, mask)
+                left = max(x1 - cx * CHUNK, 0)
+                right = min(x2 - cx * CHUNK, CHUNK - 1)
+                bits = ((1 << (right - left + 1)) - 1) << left
+                for y in range(y1, y2 + 1):
+                    if rows[y] & bits:
+                        return True
+            cx += 1
+        return False
+
+    def _build_rows(self, chunk: Chunk, mask: int) -> list[int]:
+        # フラグを "0"/"1" の文字に置き換え、右端の列を上位の桁にして2進数として読む
+        table = bytes(ord("1") if flag & mask else ord("0") for flag in range(256))
+        flags = chunk.flags
+        rows = chunk.rows[mask] = [
+            int(flags[y * CHUNK : (y + 1) * CHUNK].translate(table)[::-1], 2)
+            for y in range(self.height)
+        ]
+        return rows
+
+
+def sweep_y(tiles: TileFlags, x1: int, x2: int, y: int, dy: int, solid: int, floor=0) -> int:
+    """列 x1..x2 のタイルにかかる箱を y から dy 動かしたとき、ぶつかる手前まで動ける量
+
+    1pxずつ動かして、solid のタイルに重なる位置の手前で止めるのと同じ。
+    下に動くときは、箱の下端が floor のタイルに1px入る位置 (y % 8 == 1) でも止める
+    (上から乗れる足場)。
+    """
+    if dy > 0:
+        y1 = y + 1
+        top, bottom = y1 // TILE, (y1 + TILE - 1) // TILE
+        if tiles.any(x1, top, x2, bottom, solid):
+            return 0
+        if floor and y1 % TILE == 1 and tiles.any(x1, bottom, x2, bottom, floor):
+            return 0
+        # これより下の行には、箱の下端が行の最初の 1px に入る位置でぶつかる
+        mask = solid | floor
+        row = bottom + 1
+        while (y1 := row * TILE - TILE + 1) <= y + dy:
+            if tiles.any(x1, row, x2, row, mask):
+                return y1 - 1 - y
+            row += 1
+        return dy
+    if dy < 0:
+        y1 = y - 1
+        top, bottom = y1 // TILE, (y1 + TILE - 1) // TILE
+        if tiles.any(x1, top, x2, bottom, solid):
+            return 0
+        row = top - 1
+        while (y1 := row * TILE + TILE - 1) >= y + dy:
+            if tiles.any(x1, row, x2, row, solid):
+                return y1 + 1 - y
+            row -= 1
+        return dy
+    return 0
+
+
+def sweep_x(tiles: TileFlags, x: int, y: int, dx: int, solid: int, floor=0) -> int:
+    """箱を x から dx 動かしたとき、ぶつかる手前まで動ける量
+
+    1pxずつ動かして、solid のタイルに重なる位置の手前で止めるのと同じ。
+    箱の下端が足場に1px入っている (y % 8 == 1) ときは、floor のタイルにも横から入れない。
+    """
+    top, bottom = y // TILE, (y + TILE - 1) // TILE
+    if not (floor and y % TILE == 1):
+        floor = 0
+
+    def blocked(x1, x2):
+        if tiles.any(x1, top, x2, bottom, solid):
+            return True
+        return floor and tiles.any(x1, bottom, x2, bottom, floor)
+
+    if dx > 0:
+        x1 = x + 1
+        if blocked(x1 // TILE, (x1 + TILE - 1) // TILE):
+            return 0
+        col = (x1 + TILE - 1) // TILE + 1
+        while (x1 := col * TILE - TILE + 1) <= x + dx:
+            if blocked(col, col):
+                return x1 - 1 - x
+            col += 1
+        return dx
+    if dx < 0:
+        x1 = x - 1
+        if blocked(x1 // TILE, (x1 + TILE - 1) // TILE):
+            return 0
+        col = x1 // TILE - 1
+        while (x1 := col * TILE + TILE - 1) >= x + dx:
+            if blocked(col, col):
+                return x1 + 1 - x
+            col -= 1
+        return dx
+    return 0
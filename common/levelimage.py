@@ -0,0 +1,63 @@
+# タイルマップをチャンクごとの画像に描いておき、見えている範囲だけ blt する
+#
+#   level = levelimage.LevelImage(pyxel.tilemaps[0], height=32, colkey=2)
+#   level.load(cx)                          # チャンク cx (chunks.WIDTH 列) を画像に描く
+#   level.draw(g, scroll_x, 0, 128, 128)    # レベルの (scroll_x, 0) からを g の (0, 0) に描く
+#   level.draw_tile(tx, ty, (0, u, v))      # 変わったタイルだけ描き直す (掘った跡を重ねる)
+#   level.unload(cx)
+#
+# 毎フレーム g.bltm でタイルマップから描くと、見えているタイルを全て1つずつ描くことになる。
+# タイルはチャンクを読み込むときに1度だけ画像に描いておき、毎フレームは画面にかかる
+# チャンク (1-2枚) を blt するだけにする。
+# 画像は colkey で塗ってからタイルを透明色ごと描くので、colkey 付きで blt すると
+# bltm(..., colkey) と同じ絵になる。読み込んでいないチャンクは何も描かない。
+
+import pyxel
+
+import chunks
+
+TILE = 8
+CHUNK = chunks.WIDTH
+
+
+class LevelImage:
+    def __init__(self, tilemap: pyxel.Tilemap, height=None, colkey=0):
+        """height: 描く行数 (省略時はタイルマップの高さ)"""
+        self.tilemap = tilemap
+        self.height = height or tilemap.height
+        self.colkey = colkey
+        self.images: dict[int, pyxel.Image] = {}  # チャンク番号: 画像
+
+    def load(self, cx: int) -> pyxel.Image:
+        """チャンク cx のタイルを画像に描く"""
+        image = pyxel.Image(CHUNK * TILE, self.height * TILE)
+        image.cls(self.colkey)
+        image.bltm(0, 0, self.tilemap, cx * CHUNK * TILE, 0, CHUNK * TILE, self.height * TILE)
+        self.images[cx] = image
+        return image
+
+    def unload(self, cx: int, image=None):
+        self.images.pop(cx, None)
+
+    def draw_tile(self, x: int, y: int, overlay=None):
+        """タイル (x, y) をタイルマップから描き直す。読み込んでいないチャンクなら何もしない
+
+        overlay: (イメージバンク, u, v)。タイルの上に colkey 付きで重ねる 8x8 の絵
+        """
+        image = self.images.get(x // CHUNK)
+        if image is None:
+            return
+        px, py = x % CHUNK * TILE, y * TILE
+        image.rect(px, py, TILE, TILE, self.colkey)
+        image.bltm(px, py, self.tilemap, x * TILE, py, TILE, TILE)
+        if overlay is not None:
+            img, u, v = overlay
+            image.blt(px, py, img, u, v, TILE, TILE, self.colkey)
+
+    def draw(self, g: pyxel.Image, x: int, y: int, w: int, h: int):
+        """レベルの (x, y) から w x h の範囲を g の (0, 0) に描く"""
+        width = CHUNK * TILE
+        for cx in range(max(x, 0) // width, (x + w - 1) // width + 1):
+            image = self.images.get(cx)
+            if image is not None:
+                g.blt(cx * width - x, 0, image, 0, y, width, h, self.colkey)
@@ -0,0 +1,174 @@
+# タイルマップの当たり判定のフラグから作る、敵の移動用のグラフ
+#
+#   nav = navgraph.NavGraph(tiles, wall=SOLID | FLOOR, ladder=RADDER)
+#   nav.load(cx)                   # tiles.load(cx) の後に、チャンク cx の分を作る
+#   nav.update(tx, ty)             # tiles.set でタイルが変わったとき (掘ったブロックなど)
+#   nav.unload(cx)                 # tiles.unload(cx) の後に
+#
+#   nav.segment(tx, ty)            # タイルに立てるなら、その足場の (左端の列, 右端の列)
+#   nav.edges[ty * nav.width + tx] # 1歩で行けるノード (タイル番号) のタプル
+#   nav.distances(target)          # 各ノードから target までの歩数 (BFS、グラフが変わるまで再利用)
+#   nav.flow(target)[i]            # ノード i から target へ向かう1歩 (dx, dy)。流れ場も再利用する
+#
+# ノードは敵がいられるタイル: 下に wall か ladder があって立てるタイルと、ladder のタイル。
+# エッジは左右に1歩 (立てないタイルに出たら、真下の最初に立てるタイルへ落ちる) と、
+# ladder の上り下り。足場は行ごとに立てるタイルが続く範囲で、タイルから端を1回で引ける。
+# タイルが変わったときは、その行と上の行の足場、左右1列のエッジだけを作り直す。
+#
+# 流れ場は target からの BFS 1回で全てのノードの次の1歩を決めたもの。
+# 何体の敵が同じ target を追いかけても、探索は target かグラフが変わったときの1回で済む。
+
+from collections import deque
+
+import collision
+
+CHUNK = collision.CHUNK
+CACHE = 16  # distances と flow を覚えておく target の数
+
+
+class NavGraph:
+    def __init__(self, tiles: collision.TileFlags, wall: int, ladder: int):
+        """wall: 通れないタイルのフラグ (上に立てる)。ladder: 上り下りできるタイルのフラグ (上に立てる)"""
+        self.tiles = tiles
+        self.wall = wall
+        self.ladder = ladder
+        self.width = tiles.tilemap.width
+        self.height = tiles.height
+        self.rows: list[list[tuple[int, int]]] = [[] for _ in range(self.height)]  # 行ごとの足場
+        self.segments: dict[int, tuple[int, int]] = {}  # 立てるタイル番号: 足場 (左端の列, 右端の列)
+        self.edges: dict[int, tuple[int, ...]] = {}  # ノード: 1歩で行けるノード
+        self.version = 0  # グラフが変わるたびに増える
+        self._reverse = None  # ノード: そこへ1歩で来られるノード
+        self._distances: dict[int, dict[int, int]] = {}  # target: ノード: 歩数
+        self._flows: dict[int, dict[int, tuple[int, int]]] = {}  # target: ノード: 1歩
+
+    def load(self, cx: int):
+        self._rebuild(0, self.height - 1, cx * CHUNK - 1, (cx + 1) * CHUNK)
+
+    def unload(self, cx: int):
+        self._rebuild(0, self.height - 1, cx * CHUNK - 1, (cx + 1) * CHUNK)
+
+    def update(self, x: int, y: int):
+        """タイル (x, y) が変わった。(x, y) と上のタイルに立てるかが変わる"""
+        self._rebuild(y - 1, y, x - 1, x + 1)
+
+    def segment(self, x: int, y: int) -> tuple[int, int] | None:
+        if x < 0:
+            return None
+        return self.segments.get(y * self.width + x)
+
+    def distances(self, target: int) -> dict[int, int]:
+        """各ノードから target へ行く最短の歩数。行けないノードは含まない"""
+        dist = self._distances.get(target)
+        if dist is not None:
+            return dist
+        if self._reverse is None:
+            self._reverse = {}
+            for i, edges in self.edges.items():
+                for j in edges:
+                    self._reverse.setdefault(j, []).append(i)
+        reverse = self._reverse
+        dist = {target: 0}
+        queue = deque([target])
+        while queue:
+            i = queue.popleft()
+            d = dist[i] + 1
+            for j in reverse.get(i, ()):
+                if j not in dist:
+                    dist[j] = d
+                    queue.append(j)
+        if len(self._distances) >= CACHE:
+            del self._distances[next(iter(self._distances))]
+        self._distances[target] = dist
+        return dist
+
+    def flow(self, target: int) -> dict[int, tuple[int, int]]:
+        """各ノードから target へ最短で向かう1歩 (dx, dy)。target と行けないノードは含まない
+
+        左右 (落ちる先を含む) は (-1, 0) か (1, 0)、はしごは (0, -1) か (0, 1)。
+        """
+        flow = self._flows.get(target)
+        if flow is not None:
+            return flow
+        dist = self.distances(target)
+        flow = {}
+        for i, d in dist.items():
+            # target がノードでなくなっていれば (掘られた・チャンクを捨てた) 道はない
+            for j in self.edges.get(i, ()):
+                if dist.get(j) == d - 1:
+                    dx = j % self.width - i % self.width
+                    flow[i] = (dx, 0) if dx else (0, -1 if j < i else 1)
+                    break
+        if len(self._flows) >= CACHE:
+            del self._flows[next(iter(self._flows))]
+        self._flows[target] = flow
+        return flow
+
+    def _is_stand(self, x: int, y: int) -> bool:
+        get = self.tiles.get
+        return not get(x, y) & self.wall and get(x, y + 1) & (self.wall | self.ladder) != 0
+
+    def _rebuild(self, y1: int, y2: int, x1: int, x2: int):
+        """行 y1..y2 の足場と、列 x1..x2 のエッジを作り直す"""
+        for y in range(max(y1, 0), min(y2, self.height - 1) + 1):
+            self._build_row(y)
+        for x in range(max(x1, 0), min(x2, self.width - 1) + 1):
+            for y in range(self.height):
+                self._build_edges(x, y)
+        self.version += 1
+        self._reverse = None
+        self._distances.clear()
+        self._flows.clear()
+
+    def _build_row(self, y: int):
+        segments, base = self.segments, y * self.width
+        for left, right in self.rows[y]:
+            for x in range(left, right + 1):
+                del segments[base + x]
+        row = self.rows[y] = []
+        loaded = self.tiles.chunks
+        if not loaded:
+            return
+        x, end = min(loaded) * CHUNK, (max(loaded) + 1) * CHUNK
+        while x < end:
+            if not self._is_stand(x, y):
+                x += 1
+                continue
+            left = x
+            while x + 1 < end and self._is_stand(x + 1, y):
+                x += 1
+            segment = (left, x)
+            row.append(segment)
+            for i in range(base + left, base + x + 1):
+                segments[i] = segment
+            x += 1
+
+    def _build_edges(self, x: int, y: int):
+        i = y * self.width + x
+        get, wall, ladder = self.tiles.get, self.wall, self.ladder
+        flag = get(x, y)
+        if flag & wall or not (flag & ladder or i in self.segments):
+            self.edges.pop(i, None)
+            return
+        edges = []
+        for nx in (x - 1, x + 1):
+            if nx < 0 or nx >= self.width or get(nx, y) & wall:
+                continue
+            j = self._fall(nx, y)
+            if j is not None:
+                edges.append(j)
+        if flag & ladder and y > 0 and not get(x, y - 1) & wall:
+            edges.append(i - self.width)
+        if get(x, y + 1) & ladder:
+            edges.append(i + self.width)
+        self.edges[i] = tuple(edges)
+
+    def _fall(self, x: int, y: int) -> int | None:
+        """タイル (x, y) に出たときに止まるノード。下に立てるタイルがなければ None"""
+        if self.tiles.get(x, y) & self.ladder:
+            return y * self.width + x
+        for y in range(y, self.height):
+            i = y * self.width + x
+            if i in self.segments:
+                return i
+        return None
@@ -0,0 +1,175 @@
+# FPSとフレーム時間の計測
+#
+# 直近 SIZE フレーム分の、フレーム間隔・update時間・draw時間をリングバッファ
+# (array) に記録し、FPS とパーセンタイル (p50/p95/p99) を計算する。
+# 記録は1フレームあたり perf_counter 数回と配列への代入だけで、集計は
+# FPS_INTERVAL フレームごとにまとめて行う。
+#
+#   self.fps = perf.FPS("app", overlay=perf.OVERLAY)
+#   pyxel.run(*self.fps.wrap(self.update, self.draw))
+#
+# 環境変数:
+#   PYXEL_PERF_OVERLAY=1  overlay=perf.OVERLAY のFPSが計測値を画面に重ねて表示する
+#   PYXEL_PERF_CSV=dir    バッファが一周するたびに dir/<name>.csv に追記する
+
+import array
+import heapq
+import math
+import os
+import time
+
+import pyxel
+
+SIZE = 120  # 記録するフレーム数
+FPS_WINDOW = 30  # FPSの計算に使うフレーム数
+FPS_INTERVAL = 10  # FPSと集計値を更新するフレーム間隔
+WORST_FRAMES = 10  # 記録する遅いフレームの数
+PERCENTILES = (50, 95, 99)
+
+OVERLAY = os.environ.get("PYXEL_PERF_OVERLAY", "") not in ("", "0")
+CSV_DIR = os.environ.get("PYXEL_PERF_CSV", "")
+
+
+def percentile(values, p) -> float:
+    """ソート済みの values の p パーセンタイル (最近傍法)"""
+    if not values:
+        return 0.0
+    i = math.ceil(p / 100 * len(values)) - 1
+    return values[min(max(i, 0), len(values) - 1)]
+
+
+class FPS:
+    def __init__(self, name="app", size=SIZE, overlay=False):
+        self.name = name
+        self.size = size
+        self.overlay = overlay
+        self.value = 0
+        self.count = 0  # 開始したフレーム数。現在のフレームは count - 1
+        self.last = 0.0  # 現在のフレームの開始時刻
+        # 秒単位。スロット (フレーム番号 % size) に記録する
+        self.frame_times = array.array("d", bytes(8 * size))
+        self.update_times = array.array("d", bytes(8 * size))
+        self.draw_times = array.array("d", bytes(8 * size))
+        self.worst = []  # (フレーム時間, フレーム番号, update時間, draw時間) の最小ヒープ
+        self.overlay_lines = []
+        self.csv_path = os.path.join(CSV_DIR, f"{name}.csv") if CSV_DIR else ""
+
+    def calc(self):
+        """フレームの開始時に呼ぶ。前のフレームの時間を確定して記録する"""
+        now = time.perf_counter()
+        size = self.size
+        if self.count:
+            slot = (self.count - 1) % size
+            dt = self.frame_times[slot] = now - self.last
+            entry = (dt, self.count - 1, self.update_times[slot], self.draw_times[slot])
+            if len(self.worst) < WORST_FRAMES:
+                heapq.heappush(self.worst, entry)
+            elif dt > self.worst[0][0]:
+                heapq.heapreplace(self.worst, entry)
+        self.last = now
+        slot = self.count % size
+        self.update_times[slot] = self.draw_times[slot] = 0.0
+        self.count += 1
+        # 記録済みのフレームがバッファ1周分 (size - 1) たまるごとに書き出す
+        if self.csv_path and self.count > 1 and (self.count - 1) % (size - 1) == 0:
+            self.dump_csv(self.csv_path, append=True)
+
+        # 10フレームごとにFPSを計算
+        if self.count % FPS_INTERVAL:
+            return
+        total = sum(self.recent(self.frame_times, FPS_WINDOW))
+        if total > 0:
+            self.value = int(min(self.count - 1, FPS_WINDOW, size - 1) / total)
+        if self.overlay:
+            self.overlay_lines = self.format_stats()
+
+    def wrap(self, update, draw):
+        """update と draw を、時間を記録する関数に包んで返す"""
+
+        def timed_update():
+            self.calc()
+            t = time.perf_counter()
+            update()
+            self.update_times[(self.count - 1) % self.size] += time.perf_counter() - t
+
+        def timed_draw():
+            t = time.perf_counter()
+            result = draw()
+            self.draw_times[(self.count - 1) % self.size] += time.perf_counter() - t
+            if self.overlay:
+                self.draw_overlay()
+            return result
+
+        return timed_update, timed_draw
+
+    def recent(self, buf, n=None) -> list[float]:
+        """記録済みのフレームの値を古い順に返す (最大 n 個)"""
+        count = min(self.count - 1, self.size - 1)
+        if n is not None:
+            count = min(count, n)
+        current = (self.count - 1) % self.size
+        return [buf[(current - i) % self.size] for i in range(count, 0, -1)]
+
+    def stats(self) -> dict[str, tuple[float, ...]]:
+        """frame/update/draw のパーセンタイル (ミリ秒)"""
+        result = {}
+        for kind, buf in (
+            ("frame", self.frame_times),
+            ("update", self.update_times),
+            ("draw", self.draw_times),
+        ):
+            values = sorted(self.recent(buf))
+            result[kind] = tuple(percentile(values, p) * 1000 for p in PERCENTILES)
+        return result
+
+    def worst_frames(self) -> list[tuple[int, float, float, float]]:
+        """遅かったフレームを遅い順に (フレーム番号, frame, update, draw) ミリ秒で返す"""
+        return [
+            (n, dt * 1000, u * 1000, d * 1000)
+            for dt, n, u, d in sorted(self.worst, reverse=True)
+        ]
+
+    def format_stats(self) -> list[str]:
+        header = " ".join(f"{f'p{p}':>5}" for p in PERCENTILES)
+        lines = [f"{self.name} FPS:{self.value}", f"ms     {header}"]
+        for kind, values in self.stats().items():
+            lines.append(f"{kind:<6} " + " ".join(f"{v:5.1f}" for v in values))
+        return lines
+
+    def draw_overlay(self, img=pyxel, x=2, y=2):
+        """集計値を左上に表示する。img には pyxel.Image か pyxel モジュールを渡す"""
+        if not self.overlay_lines:
+            return
+        w = max(len(s) for s in self.overlay_lines) * pyxel.FONT_WIDTH + 2
+        h = len(self.overlay_lines) * (pyxel.FONT_HEIGHT + 1) + 1
+        img.rect(x, y, w, h, 0)
+        for i, line in enumerate(self.overlay_lines):
+            img.text(x + 1, y + 1 + i * (pyxel.FONT_HEIGHT + 1), line, 7)
+
+    def dump_csv(self, path, append=False):
+        """記録済みのフレームを CSV に書き出す (ミリ秒)"""
+        rows = zip(
+            self.recent(self.frame_times),
+            self.recent(self.update_times),
+            self.recent(self.draw_times),
+        )
+        first = self.count - 1 - min(self.count - 1, self.size - 1)
+        write_header = not (append and os.path.exists(path))
+        with open(path, "a" if append else "w", encoding="utf-8") as f:
+            if write_header:
+                f.write("frame,frame_ms,update_ms,draw_ms\n")
+            for i, (dt, u, d) in enumerate(rows):
+                f.write(f"{first + i},{dt * 1000:.3f},{u * 1000:.3f},{d * 1000:.3f}\n")
+
+    def __rmul__(self, other):
+        return self.value * other
+
+    def __rtruediv__(self, other):
+        # 計測前 (value == 0) でもゼロ除算にならないよう、1 FPS とみなす
+        return other / max(self.value, 1)
+
+    def __floordiv__(self, other):
+        return self.value // other
+
+    def __str__(self):
+        return str(self.value)
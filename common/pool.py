@@ -0,0 +1,110 @@
+# エンティティのプール
+#
+#   mutans = pool.Pool()
+#   handle = mutans.spawn(Mutan(x, y))   # 追加を予約する。flush で反映される
+#   for i, mutan in enumerate(mutans):
+#       if mutan.is_broken():
+#           mutans.despawn(mutans.handle_at(i))  # 削除を予約する。ハンドルはすぐに無効になる
+#   mutans.flush()                       # フレームの最後に予約した追加・削除を反映する
+#
+# - 削除は最後の要素を空いた位置に移す (swap-remove) ので、要素数によらず O(1)
+# - 追加と削除は flush まで反映しないので、ループの途中で追加・削除しても
+#   要素を飛ばしたり、追加した要素をそのフレームのうちに処理したりしない
+# - ハンドルはスロット番号と世代の組。削除したスロットを再利用すると世代が進むので、
+#   削除済みのエンティティを指す古いハンドルでは get できない
+# 追加・削除は予約した順に反映するので、同じ操作をすれば同じ順に並ぶ。
+
+from typing import NamedTuple
+
+
+class Handle(NamedTuple):
+    slot: int
+    generation: int
+
+
+class Pool:
+    def __init__(self):
+        self.items = []  # 生きているエンティティ (密な配列)
+        self._item_slots = []  # items と同じ順: スロット番号
+        self._objects = []  # スロット番号: エンティティ (空きスロットは None)
+        self._generations = []  # スロット番号: 世代
+        self._index = []  # スロット番号: items での位置 (追加待ちは -1)
+        self._free = []  # 空きスロット
+        self._spawn_queue: list[Handle] = []
+        self._despawn_queue: list[int] = []  # スロット番号
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def handle_at(self, i: int) -> Handle:
+        """items[i] のハンドル"""
+        slot = self._item_slots[i]
+        return Handle(slot, self._generations[slot])
+
+    def spawn(self, obj) -> Handle:
+        """obj の追加を予約する。flush までは items に含まれない"""
+        if self._free:
+            slot = self._free.pop()
+            self._objects[slot] = obj
+        else:
+            slot = len(self._objects)
+            self._objects.append(obj)
+            self._generations.append(0)
+            self._index.append(-1)
+        handle = Handle(slot, self._generations[slot])
+        self._spawn_queue.append(handle)
+        return handle
+
+    def despawn(self, handle: Handle) -> bool:
+        """削除を予約する。すでに削除したハンドルなら False"""
+        if not self.is_alive(handle):
+            return False
+        self._generations[handle.slot] += 1
+        self._despawn_queue.append(handle.slot)
+        return True
+
+    def is_alive(self, handle: Handle) -> bool:
+        slot, generation = handle
+        return 0 <= slot < len(self._generations) and self._generations[slot] == generation
+
+    def get(self, handle: Handle):
+        """ハンドルが指すエンティティ。削除済みなら None"""
+        return self._objects[handle.slot] if self.is_alive(handle) else None
+
+    def flush(self):
+        """予約した削除と追加を反映する"""
+        items, item_slots, index = self.items, self._item_slots, self._index
+        for slot in self._despawn_queue:
+            i = index[slot]
+            if i >= 0:
+                # 最後の要素を空いた位置に移す
+                last = len(items) - 1
+                if i != last:
+                    items[i] = items[last]
+                    item_slots[i] = item_slots[last]
+                    index[item_slots[i]] = i
+                items.pop()
+                item_slots.pop()
+                index[slot] = -1
+            self._objects[slot] = None
+            self._free.append(slot)
+        self._despawn_queue.clear()
+
+        for slot, generation in self._spawn_queue:
+            if self._generations[slot] != generation:
+                continue  # 追加する前に削除された
+            index[slot] = len(items)
+            items.append(self._objects[slot])
+            item_slots.append(slot)
+        self._spawn_queue.clear()
+
+    def clear(self):
+        """全て削除する (追加待ちのエンティティも含む)"""
+        for i in range(len(self.items)):
+            self.despawn(self.handle_at(i))
+        for handle in self._spawn_queue:
+            self.despawn(handle)
+        self.flush()
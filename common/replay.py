@@ -0,0 +1,158 @@
+# キー入力の記録と再生
+#
+#   self.input = replay.Input((pyxel.KEY_LEFT, pyxel.KEY_RIGHT, pyxel.KEY_SPACE))
+#   pyxel.run(self.input.wrap(self.update), self.draw)
+#
+# 環境変数:
+#   PYXEL_RECORD=<file>  フレームごとに押しているキーと、乱数のシードを記録する
+#   PYXEL_REPLAY=<file>  記録したとおりにキーを押す。最後まで再生したら終了する
+#   PYXEL_SEED=<n>       記録するときの乱数のシード (省略時は時刻から決める)
+# どちらも指定しないときは何もしない (pyxel.btn などは本物のまま)。
+#
+# 記録中も再生中も、btn/btnp/btnr は「各フレームで押しているキー」だけから計算する。
+# 記録したときと同じ値を再生でも返すので、プレイをフレーム単位で再現できる。
+#
+# ファイル形式 (リトルエンディアン):
+#   ヘッダ: "PXRP", バージョン(u8), シード(u32), キー数 n(u8), キーコード(u32) x n
+#   以降:   押しているキーのビットマスク(u32), そのマスクが続くフレーム数(u16) の繰り返し
+
+import atexit
+import os
+import struct
+import time
+
+import pyxel
+
+MAGIC = b"PXRP"
+VERSION = 1
+HEADER = struct.Struct("<4sBIB")
+RUN = struct.Struct("<IH")
+MAX_RUN = 0xFFFF
+
+
+def load(filename) -> tuple[int, tuple[int, ...], list[tuple[int, int]]]:
+    """記録ファイルを (シード, キーコード, [(マスク, フレーム数)]) にする"""
+    with open(filename, "rb") as f:
+        data = f.read()
+    magic, version, seed, n = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"{filename}: not a replay file")
+    keys = struct.unpack_from(f"<{n}I", data, HEADER.size)
+    offset = HEADER.size + 4 * n
+    end = offset + (len(data) - offset) // RUN.size * RUN.size  # 途中で切れた記録は捨てる
+    runs = [RUN.unpack_from(data, i) for i in range(offset, end, RUN.size)]
+    return seed, keys, runs
+
+
+class Input:
+    def __init__(self, keys, record=None, replay=None):
+        """keys: アプリが btn/btnp/btnr で調べるキー (32個まで)"""
+        self.keys = tuple(keys)
+        if len(self.keys) > 32:
+            raise ValueError("too many keys to record")
+        self.bits = {key: 1 << i for i, key in enumerate(self.keys)}
+        record = os.environ.get("PYXEL_RECORD", "") if record is None else record
+        replay = os.environ.get("PYXEL_REPLAY", "") if replay is None else replay
+        self.recording = bool(record) and not replay
+        self.replaying = bool(replay)
+        if not (self.recording or self.replaying):
+            return
+
+        self.frame = -1
+        self.mask = 0  # 現在のフレームで押しているキー
+        self.released = 0  # 現在のフレームで離したキー
+        self.pressed_at = {}  # 押しているキー: 押し始めたフレーム
+        self.real_btn = pyxel.btn
+        if self.replaying:
+            self.seed, keys, runs = load(replay)
+            if keys != self.keys:
+                raise ValueError(f"{replay}: recorded with different keys")
+            self.runs = iter(runs)
+            self.run_mask, self.run_left = 0, 0
+        else:
+            self.seed = int(os.environ.get("PYXEL_SEED", time.time_ns())) & 0xFFFFFFFF
+            self.file = open(record, "wb")
+            self.file.write(HEADER.pack(MAGIC, VERSION, self.seed, len(self.keys)))
+            self.file.write(struct.pack(f"<{len(self.keys)}I", *self.keys))
+            self.file.flush()
+            self.run_mask, self.run_length = 0, 0
+            atexit.register(self.close)
+        pyxel.rseed(self.seed)
+        pyxel.btn = self.btn
+        pyxel.btnp = self.btnp
+        pyxel.btnr = self.btnr
+
+    def wrap(self, update):
+        """フレームの最初に入力を進めてから update を呼ぶ関数を返す"""
+        if not (self.recording or self.replaying):
+            return update
+
+        def update_with_input():
+            self.step()
+            update()
+
+        return update_with_input
+
+    def step(self):
+        """次のフレームの、押しているキーを決める"""
+        self.frame += 1
+        if self.replaying:
+            while self.run_left == 0:
+                run = next(self.runs, None)
+                if run is None:
+                    pyxel.quit()  # 最後まで再生した
+                    return
+                self.run_mask, self.run_left = run
+            self.run_left -= 1
+            mask = self.run_mask
+        else:
+            mask = 0
+            for key, bit in self.bits.items():
+                if self.real_btn(key):
+                    mask |= bit
+            self.append(mask)
+
+        pressed = mask & ~self.mask
+        self.released = self.mask & ~mask
+        if pressed:
+            for key, bit in self.bits.items():
+                if pressed & bit:
+                    self.pressed_at[key] = self.frame
+        self.mask = mask
+
+    def append(self, mask):
+        if self.run_length and (mask != self.run_mask or self.run_length == MAX_RUN):
+            self.file.write(RUN.pack(self.run_mask, self.run_length))
+            self.file.flush()
+            self.run_length = 0
+        self.run_mask = mask
+        self.run_length += 1
+
+    def close(self):
+        if self.recording and not self.file.closed:
+            if self.run_length:
+                self.file.write(RUN.pack(self.run_mask, self.run_length))
+            self.file.close()
+
+    def bit(self, key) -> int:
+        try:
+            return self.bits[key]
+        except KeyError:
+            raise ValueError(f"key {key} is not recorded") from None
+
+    def btn(self, key):
+        return bool(self.mask & self.bit(key))
+
+    def btnp(self, key, hold=None, repeat=None):
+        if not self.mask & self.bit(key):
+            return False
+        elapsed = self.frame - self.pressed_at[key]
+        if elapsed == 0:
+            return True
+        if hold and repeat:
+            elapsed -= hold
+            return elapsed > 0 and elapsed % repeat == 0
+        return False
+
+    def btnr(self, key):
+        return bool(self.released & self.bit(key))
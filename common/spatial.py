@@ -0,0 +1,81 @@
+# タイル座標ごとの空間インデックス (一様グリッド)
+#
+#   grid = spatial.Grid()               # 物体の get_location() (8pxタイル座標) をキーにする
+#   grid.insert_all(mutans)
+#   grid.move_all(mutans)               # 移動したあと、タイルが変わった物体だけ付け替える
+#   grid.at(brush.get_location())       # そのタイルにいる物体
+#   grid.near((tx, ty))                 # 周囲 3x3 タイルにいる物体
+#
+# 全ての物体を走査する代わりに、調べるタイルの数だけ辞書を引けばよい。
+# タイルごとの物体は追加した順に並ぶので、同じ操作をすれば同じ順に返す。
+
+import operator
+
+get_location = operator.methodcaller("get_location")
+
+
+class Grid:
+    def __init__(self, key=get_location):
+        """key: 物体からタイル座標 (x, y) を返す関数"""
+        self.key = key
+        self.cells: dict[tuple[int, int], dict] = {}  # タイル座標: {物体: None}
+        self.locations: dict[object, tuple[int, int]] = {}  # 物体: タイル座標
+
+    def __len__(self) -> int:
+        return len(self.locations)
+
+    def __contains__(self, obj) -> bool:
+        return obj in self.locations
+
+    def clear(self):
+        self.cells.clear()
+        self.locations.clear()
+
+    def insert(self, obj):
+        loc = self.locations[obj] = self.key(obj)
+        cell = self.cells.get(loc)
+        if cell is None:
+            cell = self.cells[loc] = {}
+        cell[obj] = None
+
+    def insert_all(self, objs):
+        for obj in objs:
+            self.insert(obj)
+
+    def remove(self, obj):
+        loc = self.locations.pop(obj)
+        cell = self.cells[loc]
+        del cell[obj]
+        if not cell:
+            del self.cells[loc]
+
+    def move(self, obj) -> bool:
+        """物体の位置が変わったら呼ぶ。タイルが変わったら True"""
+        loc = self.key(obj)
+        if self.locations[obj] == loc:
+            return False
+        self.remove(obj)
+        self.insert(obj)
+        return True
+
+    def move_all(self, objs):
+        key, locations = self.key, self.locations
+        for obj in objs:
+            if locations[obj] != key(obj):
+                self.remove(obj)
+                self.insert(obj)
+
+    def at(self, loc: tuple[int, int]) -> list:
+        """タイル loc にいる物体"""
+        cell = self.cells.get(loc)
+        return list(cell) if cell else []
+
+    def near(self, loc: tuple[int, int], radius: int = 1):
+        """タイル loc から縦横 radius タイル以内にいる物体"""
+        x, y = loc
+        cells = self.cells
+        for ty in range(y - radius, y + radius + 1):
+            for tx in range(x - radius, x + radius + 1):
+                cell = cells.get((tx, ty))
+                if cell:
+                    yield from cell
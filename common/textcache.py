@@ -0,0 +1,83 @@
+# 縁取り文字の描画キャッシュ
+#
+# 縁取り文字は、同じ文字列を周囲8方向+本体の9回 text で描画する必要がある。
+# (文字列, 色, 縁の色, フォント) ごとに1回だけオフスクリーンの pyxel.Image に
+# 描画しておき、以降は blt 1回で描画する。キャッシュはLRUで上限を超えたら古い順に捨てる。
+
+import collections
+
+import pyxel
+
+MAX_ENTRIES = 256
+_PROBE_TEXT = "|[]_gjpqyあ"  # 高さの計測に使う文字列
+
+_images = collections.OrderedDict()  # (s, col, bcol, font): (Image, colkey)
+_font_heights = {}  # font: height
+
+
+def font_height(font) -> int:
+    """フォントの高さ(描画される最下段まで)を実際に描画して測る"""
+    if font is None:
+        return pyxel.FONT_HEIGHT
+    if font in _font_heights:
+        return _font_heights[font]
+
+    w = max(font.text_width(_PROBE_TEXT), 1)
+    h = 64
+    probe = pyxel.Image(w, h)
+    probe.cls(0)
+    probe.text(0, 0, _PROBE_TEXT, 1, font)
+    height = next(
+        (y + 1 for y in range(h - 1, -1, -1) if any(probe.pget(x, y) for x in range(w))),
+        h,
+    )
+    _font_heights[font] = height
+    return height
+
+
+def text_width(s: str, font) -> int:
+    if font is None:
+        return len(s) * pyxel.FONT_WIDTH
+    return font.text_width(s)
+
+
+def bordered_text_image(s: str, col: int, bcol: int, font):
+    """縁取り文字を描画した画像と透明色を返す
+
+    画像は縁の分だけ上下左右に1px大きく、(1, 1) が文字の描画位置になる。
+    """
+    key = (s, col, bcol, font)
+    entry = _images.get(key)
+    if entry is not None:
+        _images.move_to_end(key)
+        return entry
+
+    # 文字にも縁にも使っていない色を透明色にする
+    colkey = next(c for c in range(16) if c not in (col, bcol))
+    img = pyxel.Image(text_width(s, font) + 2, font_height(font) + 2)
+    img.cls(colkey)
+    for dx in range(3):
+        for dy in range(3):
+            if dx != 1 or dy != 1:
+                img.text(dx, dy, s, bcol, font)
+    img.text(1, 1, s, col, font)
+
+    entry = _images[key] = (img, colkey)
+    if len(_images) > MAX_ENTRIES:
+        _images.popitem(last=False)
+    return entry
+
+
+def draw_text_with_border(img, x, y, s, col, bcol, font):
+    """縁取り文字を描画する
+
+    img には pyxel.Image のほか、画面に描画する場合は pyxel モジュールを渡せる。
+    """
+    if not s:
+        return
+    g, colkey = bordered_text_image(s, col, bcol, font)
+    img.blt(x - 1, y - 1, g, 0, 0, g.width, g.height, colkey)
+
+
+def clear():
+    _images.clear()
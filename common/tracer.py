@@ -0,0 +1,146 @@
+# 区間ごとの処理時間のトレース
+#
+#   @tracer.scoped("diagonal.render")
+#   def render(self): ...
+#
+#   with tracer.scope("collision"):
+#       ...
+#
+# 実行中の区間の内側で開始した区間は、その子として入れ子になる。
+# 親アプリの update の中で子アプリの update を呼べば、子アプリの区間は自動的に
+# 親の区間の下にぶら下がる。
+#
+# 環境変数 PYXEL_TRACE=<file> を指定したときだけ記録し、Chrome の Trace Event 形式
+# (JSON Array Format) で書き出す。chrome://tracing や https://ui.perfetto.dev で開ける。
+# 指定しないときは scoped は元の関数をそのまま返し、scope は何もしない。
+
+import atexit
+import collections
+import contextlib
+import functools
+import json
+import os
+import time
+
+FLUSH_EVENTS = 1000  # この数だけイベントがたまったら、最上位の区間の終わりで書き出す
+
+_path = ""
+_file = None
+_stack = []  # 実行中の区間名
+_pending = []  # 書き出し前のイベント
+_totals = collections.defaultdict(lambda: [0, 0])  # "親/子" のパス: [回数, 合計ns]
+_null = contextlib.nullcontext()
+
+
+def enable(path: str):
+    """記録を有効にする。これより後に定義された scoped から記録の対象になる"""
+    global _path
+    _path = path
+    # 書き出す前のイベントは終了時に書き出す (FLUSH_EVENTS に届かない短い実行でも)
+    atexit.unregister(close)
+    if path:
+        atexit.register(close)
+
+
+def enabled() -> bool:
+    return bool(_path)
+
+
+class Scope:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        _stack.append(self.name)
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        dur = time.perf_counter_ns() - self.start
+        path = "/".join(_stack)
+        _stack.pop()
+        _pending.append((self.name, self.start, dur, path))
+        total = _totals[path]
+        total[0] += 1
+        total[1] += dur
+        if not _stack and len(_pending) >= FLUSH_EVENTS:
+            flush()
+        return False
+
+
+def scope(name: str):
+    """with で使う区間。記録が無効なら何もしないコンテキストマネージャを返す"""
+    if not _path:
+        return _null
+    return Scope(name)
+
+
+def scoped(name: str):
+    """関数全体を区間にするデコレータ"""
+
+    def decorator(func):
+        if not _path:
+            return func
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with Scope(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def flush():
+    """たまったイベントをファイルに追記する
+
+    最後の "]" は終了時に書く。途中で強制終了しても、"]" のない JSON Array Format は
+    Trace Event 形式として読み込める。
+    """
+    global _file
+    if not _path or not _pending:
+        return
+    if _file is None:
+        _file = open(_path, "w", encoding="utf-8")
+        _file.write("[\n")
+    else:
+        _file.write(",\n")
+    pid = os.getpid()
+    _file.write(
+        ",\n".join(
+            json.dumps(
+                {
+                    "name": name,
+                    "ph": "X",
+                    "ts": start / 1000,
+                    "dur": dur / 1000,
+                    "pid": pid,
+                    "tid": 0,
+                    "args": {"path": path},
+                }
+            )
+            for name, start, dur, path in _pending
+        )
+    )
+    _file.flush()
+    _pending.clear()
+
+
+def close():
+    global _file
+    flush()
+    if _file is not None:
+        _file.write("\n]\n")
+        _file.close()
+        _file = None
+
+
+def summary() -> list[tuple[str, int, float]]:
+    """区間のパスごとの (パス, 回数, 合計ミリ秒) をパス順に返す"""
+    return [(path, n, ns / 1e6) for path, (n, ns) in sorted(_totals.items())]
+
+
+enable(os.environ.get("PYXEL_TRACE", ""))
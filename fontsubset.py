@@ -0,0 +1,142 @@
+# 数字で始まる各ディレクトリの assets/*.bdf から、アプリで使う文字だけを抜き出した
+# サブセットBDF (assets/*.subset.bdf) を作る
+#
+# uv run fontsubset.py            # 全アプリ
+# uv run fontsubset.py 03-slide   # 指定したアプリのみ
+#
+# 日本語BDFは数MBあり、pyxel.Font の読み込みに時間とメモリを使うため、
+# アプリでは表示する文字のグリフとメトリクスだけを持つサブセットを読み込む。
+
+import ast
+import json
+import string
+import sys
+from pathlib import Path
+
+SUBSET_SUFFIX = ".subset.bdf"
+# 動的に組み立てる文字列(スコアやFPSなど)のため、ASCII印字可能文字は常に含める
+BASE_CHARS = set(string.printable) - set("\t\n\r\x0b\x0c")
+
+
+def is_subset(path: Path) -> bool:
+    return path.name.endswith(SUBSET_SUFFIX)
+
+
+def subset_path(path: Path) -> Path:
+    return path.with_name(path.name.removesuffix(".bdf") + SUBSET_SUFFIX)
+
+
+def font_files(directory: Path) -> list[Path]:
+    return sorted(p for p in directory.glob("assets/*.bdf") if not is_subset(p))
+
+
+def text_sources(directory: Path) -> list[Path]:
+    """画面に表示される文字列を含むファイル"""
+    sources = [p for p in directory.rglob("*.py") if "__pycache__" not in p.parts]
+    sources += directory.glob("assets/*.md")
+    sources += directory.glob("assets/*.json")
+    return sorted(sources)
+
+
+def _json_strings(obj):
+    if isinstance(obj, str):
+        yield obj
+    elif isinstance(obj, dict):
+        for k, v in obj.items():
+            yield k
+            yield from _json_strings(v)
+    elif isinstance(obj, list):
+        for v in obj:
+            yield from _json_strings(v)
+
+
+def collect_chars(path: Path) -> set[str]:
+    text = path.read_text(encoding="utf-8")
+    if path.suffix == ".py":
+        # コメントとdocstringは除き、文字列リテラル(f-string含む)の文字だけを集める
+        tree = ast.parse(text)
+        docstrings = {
+            id(node.value)
+            for node in ast.walk(tree)
+            if isinstance(node, ast.Expr) and isinstance(node.value, ast.Constant)
+        }
+        strings = [
+            node.value
+            for node in ast.walk(tree)
+            if isinstance(node, ast.Constant)
+            and isinstance(node.value, str)
+            and id(node) not in docstrings
+        ]
+    elif path.suffix == ".json":
+        strings = list(_json_strings(json.loads(text)))
+    else:
+        strings = [text]
+
+    chars = set()
+    for s in strings:
+        chars.update(s)
+        chars.update(s.lower())
+        chars.update(s.upper())
+    return chars
+
+
+def subset_bdf(src: Path, dst: Path, chars: set[str]) -> tuple[int, int]:
+    """charsに含まれる文字のグリフだけを残したBDFをdstに書き出す
+
+    戻り値: (元のグリフ数, 残したグリフ数)
+    """
+    header, _, body = src.read_text(encoding="latin-1").partition("\nSTARTCHAR ")
+    codes = {ord(c) for c in chars}
+    for line in header.splitlines():
+        if line.startswith("DEFAULT_CHAR "):
+            codes.add(int(line.split()[1]))
+
+    glyphs = []
+    body = body.rsplit("\nENDFONT", 1)[0]
+    for glyph in body.split("\nSTARTCHAR "):
+        encoding = glyph.split("\nENCODING ", 1)[1].split("\n", 1)[0]
+        if int(encoding.split()[0]) in codes:
+            glyphs.append("STARTCHAR " + glyph.rstrip("\n"))
+    total = body.count("\nSTARTCHAR ") + 1
+
+    lines = [
+        f"CHARS {len(glyphs)}" if line.startswith("CHARS ") else line
+        for line in header.splitlines()
+    ]
+    dst.write_text(
+        "\n".join(lines + glyphs + ["ENDFONT", ""]), encoding="latin-1"
+    )
+    return total, len(glyphs)
+
+
+def process_directory(directory: Path, force: bool = False):
+    fonts = font_files(directory)
+    if not fonts:
+        return
+    sources = text_sources(directory)
+    latest = max(p.stat().st_mtime for p in sources) if sources else 0
+    chars = None
+    for font in fonts:
+        dst = subset_path(font)
+        mtime = max(latest, font.stat().st_mtime)
+        if not force and dst.exists() and dst.stat().st_mtime >= mtime:
+            continue  # 生成済みで最新
+        if chars is None:
+            chars = set(BASE_CHARS)
+            for path in sources:
+                chars |= collect_chars(path)
+        total, used = subset_bdf(font, dst, chars)
+        print(f"{dst}: {used}/{total} glyphs")
+
+
+def main():
+    force = "--force" in sys.argv[1:]
+    targets = [Path(a) for a in sys.argv[1:] if not a.startswith("--")]
+    if not targets:
+        targets = [p for p in Path(".").glob("[0-9][0-9]-*") if p.is_dir()]
+    for directory in sorted(targets):
+        process_directory(directory, force=force)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,308 @@
+# ウィンドウを開かずにアプリを実行する
+#
+# uv run headless.py 09-mutans                          # 600フレーム実行
+# uv run headless.py 08-jumpman --frames 300 --tape tape.txt --seed 1 --screenshot out.png
+# uv run headless.py 10-anahori --tape a.txt b.txt c.txt --jobs 3  # テープごとに別プロセスで実行
+#
+# pyxel モジュールを差し替えてアプリの main.py を実行する。差し替えたモジュールは
+# - init/run: ウィンドウを開かず、run で update/draw を指定フレーム数だけ待たずに呼ぶ
+# - btn/btnp/btnr: 入力テープ (--tape) に従ってキーを押す
+# - load: .pyxres を読んで pyxel.images/tilemaps (本物の Image/Tilemap) に書き込む
+# - cls/blt/text など画面への描画: 画面の代わりの pyxel.Image に描画する
+# - rndi/rndf: --seed で初期化した pyxel の乱数をそのまま使う
+# それ以外 (Image, Font, KEY_*, ceil など) は本物の pyxel をそのまま使う。
+#
+# 入力テープは1行に「フレーム番号 キー名+キー名」を書く。そのフレームから次の行の
+# フレームまで、書いたキーを押し続ける。キー名を書かない行は全てのキーを離す。
+#
+#   # 30フレーム目から右を押し、60フレーム目からジャンプも押す
+#   30 KEY_RIGHT
+#   60 KEY_RIGHT+KEY_SPACE
+#   61 KEY_RIGHT
+#   90
+#
+# テープを複数指定すると、1本ずつ別のプロセス (--jobs 個まで同時) で実行して
+# テープごとの画面のハッシュを出す。アプリの状態はプロセスごとに別なので、
+# 入力を変えたシミュレーションをコアの数だけ並べて動かせる。
+
+import argparse
+import array
+import concurrent.futures
+import hashlib
+import os
+import random
+import runpy
+import sys
+import time
+import tomllib
+import types
+import zipfile
+from pathlib import Path
+
+import pyxel
+
+# 画面の代わりの Image に委譲する描画関数
+SCREEN_FUNCS = (
+    "camera", "clip", "pal", "dither", "cls", "pget", "pset", "line", "rect", "rectb",
+    "circ", "circb", "elli", "ellib", "tri", "trib", "fill", "blt", "bltm", "text",
+)
+# 何もしない関数
+NOOP_FUNCS = ("mouse", "play", "playm", "stop", "show", "flip", "title", "icon", "fullscreen")
+
+
+class Finished(BaseException):
+    """指定したフレーム数を実行した (または pyxel.quit が呼ばれた)"""
+
+
+def parse_tape(text: str) -> list[tuple[int, frozenset[int]]]:
+    """入力テープを (フレーム番号, 押しているキー) のリストにする"""
+    tape = []
+    for lineno, line in enumerate(text.splitlines(), 1):
+        line = line.split("#", 1)[0].strip()
+        if not line:
+            continue
+        frame, _, keys = line.partition(" ")
+        try:
+            codes = frozenset(getattr(pyxel, k) for k in keys.split("+") if k.strip())
+        except AttributeError as e:
+            raise ValueError(f"tape line {lineno}: unknown key {e.name}") from None
+        tape.append((int(frame), codes))
+    tape.sort(key=lambda entry: entry[0])
+    return tape
+
+
+def _expand_rows(rows: list[list[int]], width: int, height: int) -> list[list[int]]:
+    """.pyxres の省略された行を展開する
+
+    行は最後の値を、データは最後の行を繰り返して width x height にする。
+    """
+    rows = [row + [row[-1]] * (width - len(row)) for row in rows]
+    return rows + [rows[-1]] * (height - len(rows))
+
+
+def load_resource(filename: str, exclude_images=False, exclude_tilemaps=False):
+    """.pyxres (format_version 4) のイメージとタイルマップを pyxel のバンクに読み込む"""
+    with zipfile.ZipFile(filename) as z:
+        resource = tomllib.loads(z.read("pyxel_resource.toml").decode())
+    if resource.get("format_version") != 4:
+        raise ValueError(f"{filename}: unsupported format_version")
+
+    if not exclude_images:
+        for img, spec in zip(pyxel.images, resource.get("images", [])):
+            rows = _expand_rows(spec["data"], spec["width"], spec["height"])
+            if max(map(max, rows)) < 16:
+                img.set(0, 0, ["".join(f"{c:x}" for c in row) for row in rows])
+            else:
+                for y, row in enumerate(rows):
+                    for x, c in enumerate(row):
+                        img.pset(x, y, c)
+
+    if not exclude_tilemaps:
+        for tm, spec in zip(pyxel.tilemaps, resource.get("tilemaps", [])):
+            width, height = spec["width"], spec["height"]
+            rows = _expand_rows(spec["data"], width * 2, height)
+            tm.imgsrc = spec.get("imgsrc", 0)
+            tm.cls((0, 0))
+            for y, row in enumerate(rows):
+                for x in range(width):
+                    tile = (row[x * 2], row[x * 2 + 1])
+                    if tile != (0, 0):
+                        tm.pset(x, y, tile)
+
+
+class HeadlessPyxel(types.ModuleType):
+    """アプリから pyxel として見える、ウィンドウを使わないモジュール"""
+
+    def __init__(self, frames: int, tape=(), seed: int = 0, setup=None):
+        super().__init__("pyxel")
+        self.frames = frames
+        self.tape = list(tape)
+        self.seed = seed
+        self.setup = setup  # setup(モジュール, update, draw): 最初のフレームの前に呼ぶ
+        self.frame_count = 0
+        self.width = 0
+        self.height = 0
+        self.mouse_x = 0
+        self.mouse_y = 0
+        self.mouse_wheel = 0
+        self.screen = None
+        self.held = frozenset()  # 現在のフレームで押しているキー
+        self.pressed_at = {}  # 押しているキー: 押し始めたフレーム
+        self.released = frozenset()  # 現在のフレームで離したキー
+        self.update_times = array.array("d")  # 秒
+        self.draw_times = array.array("d")
+        for name in NOOP_FUNCS:
+            setattr(self, name, _noop)
+
+    def __getattr__(self, name):
+        return getattr(pyxel, name)
+
+    # システム
+    def init(self, width, height, title=None, fps=30, **kwargs):
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.screen = pyxel.Image(width, height)
+        for name in SCREEN_FUNCS:
+            setattr(self, name, getattr(self.screen, name))
+        pyxel.rseed(self.seed)
+        random.seed(self.seed)
+
+    def run(self, update, draw):
+        if self.setup is not None:
+            # 実行中のアプリの main.py は __main__ として登録されている
+            self.setup(sys.modules["__main__"], update, draw)
+        tape = iter(self.tape)
+        next_entry = next(tape, None)
+        for frame in range(self.frames):
+            self.frame_count = frame
+            self.released = frozenset()
+            while next_entry is not None and next_entry[0] <= frame:
+                self.set_keys(next_entry[1], frame)
+                next_entry = next(tape, None)
+
+            t0 = time.perf_counter()
+            update()
+            t1 = time.perf_counter()
+            draw()
+            t2 = time.perf_counter()
+            self.update_times.append(t1 - t0)
+            self.draw_times.append(t2 - t1)
+        raise Finished
+
+    def quit(self):
+        raise Finished
+
+    def load(self, filename, exclude_images=False, exclude_tilemaps=False, *args, **kwargs):
+        load_resource(filename, exclude_images, exclude_tilemaps)
+
+    # 入力
+    def set_keys(self, keys: frozenset[int], frame: int):
+        self.released |= self.held - keys
+        for key in self.held - keys:
+            del self.pressed_at[key]
+        for key in keys - self.held:
+            self.pressed_at[key] = frame
+        self.held = keys
+
+    def btn(self, key):
+        return key in self.held
+
+    def btnp(self, key, hold=None, repeat=None):
+        if key not in self.held:
+            return False
+        elapsed = self.frame_count - self.pressed_at[key]
+        if elapsed == 0:
+            return True
+        if hold and repeat:
+            elapsed -= hold
+            return elapsed > 0 and elapsed % repeat == 0
+        return False
+
+    def btnr(self, key):
+        return key in self.released
+
+    def screen_digest(self) -> str:
+        """画面の内容のハッシュ (描画結果の比較用)"""
+        pixels = bytes(
+            self.screen.pget(x, y) for y in range(self.height) for x in range(self.width)
+        )
+        return hashlib.sha1(pixels).hexdigest()
+
+
+def _noop(*args, **kwargs):
+    pass
+
+
+def run_app(
+    app_dir, frames=600, tape=(), seed=0, script="main.py", setup=None
+) -> HeadlessPyxel:
+    """app_dir を作業ディレクトリにして script を __main__ として実行する"""
+    app_dir = Path(app_dir).resolve()
+    stub = HeadlessPyxel(frames, tape, seed, setup)
+    modules = set(sys.modules)
+    saved_path, saved_cwd = sys.path[:], os.getcwd()
+    sys.modules["pyxel"] = stub
+    sys.path.insert(0, str(app_dir))
+    os.chdir(app_dir)
+    try:
+        runpy.run_path(script, run_name="__main__")
+    except Finished:
+        pass
+    finally:
+        os.chdir(saved_cwd)
+        sys.path[:] = saved_path
+        # アプリが import したモジュールは、次の実行で読み直す
+        for name in set(sys.modules) - modules:
+            del sys.modules[name]
+        sys.modules["pyxel"] = pyxel
+    return stub
+
+
+def _run_tape(app_dir, frames, tape_path, seed, script) -> tuple[int, float, str | None]:
+    """run_many の1本分 (子プロセスで実行する)。(フレーム数, 秒, 画面のハッシュ) を返す"""
+    tape = parse_tape(tape_path.read_text(encoding="utf-8"))
+    t0 = time.perf_counter()
+    stub = run_app(app_dir, frames, tape, seed, script)
+    elapsed = time.perf_counter() - t0
+    digest = stub.screen_digest() if stub.screen is not None else None
+    return len(stub.update_times), elapsed, digest
+
+
+def run_many(app_dir, frames, tape_paths, seed=0, script="main.py", jobs=None):
+    """テープごとに app_dir を別のプロセスで実行する。テープの順に結果を返す"""
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [
+            executor.submit(_run_tape, app_dir, frames, path, seed, script)
+            for path in tape_paths
+        ]
+        return [future.result() for future in futures]
+
+
+def _ms(values) -> str:
+    values = sorted(values)
+    if not values:
+        return "-"
+    mean = sum(values) / len(values)
+    p95 = values[min(len(values) - 1, int(len(values) * 0.95))]
+    return f"mean {mean * 1000:.3f} ms, p95 {p95 * 1000:.3f} ms"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="run a pyxel app without a window")
+    parser.add_argument("app_dir", type=Path)
+    parser.add_argument("--script", default="main.py")
+    parser.add_argument("--frames", type=int, default=600)
+    parser.add_argument("--tape", type=Path, nargs="+", help="input tape file(s)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--screenshot", type=Path, help="save the last frame as png")
+    parser.add_argument("--jobs", type=int, help="processes for multiple tapes")
+    args = parser.parse_args()
+
+    if args.tape and len(args.tape) > 1:
+        t0 = time.perf_counter()
+        results = run_many(
+            args.app_dir, args.frames, args.tape, args.seed, args.script, args.jobs
+        )
+        elapsed = time.perf_counter() - t0
+        print(f"{args.app_dir}: {len(results)} tapes in {elapsed:.2f} s")
+        for path, (frames, seconds, digest) in zip(args.tape, results):
+            print(f"  {path}: {frames} frames in {seconds:.2f} s, screen {digest}")
+        return
+
+    tape = parse_tape(args.tape[0].read_text(encoding="utf-8")) if args.tape else ()
+    t0 = time.perf_counter()
+    stub = run_app(args.app_dir, args.frames, tape, args.seed, args.script)
+    elapsed = time.perf_counter() - t0
+
+    print(f"{args.app_dir}: {len(stub.update_times)} frames in {elapsed:.2f} s")
+    print(f"  update: {_ms(stub.update_times)}")
+    print(f"  draw:   {_ms(stub.draw_times)}")
+    if stub.screen is not None:
+        print(f"  screen: {stub.screen_digest()}")
+        if args.screenshot:
+            stub.screen.save(str(args.screenshot.resolve().with_suffix("")), 1)
+
+
+if __name__ == "__main__":
+    main()
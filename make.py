@@ -6,12 +6,15 @@ import subprocess
 from pathlib import Path
 import shutil
 
+import fontsubset
+
 
 # 任意のディレクトリに対して以下を実行する
 def process_directory(directory: Path):
     shutil.rmtree(directory / "__pycache__", ignore_errors=True)
     shutil.rmtree(directory / "assets" / "__pycache__", ignore_errors=True)
     shutil.rmtree(directory / "_build", ignore_errors=True)
+    fontsubset.process_directory(directory)  # 使用文字だけのフォントを更新
     subprocess.run(["uvx", "pyxel", "package", directory, directory / "main.py"])
     Path(f"{directory}.pyxapp").replace(f"dist/{directory}.pyxapp")
     with Path("template.html").open("r") as f: